@@ -1,31 +1,48 @@
 import json
 import random
 import re
-import copy
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 
-def parse_locomo_session_time(s):
-    return datetime.strptime(s, "%I:%M %p on %d %B, %Y")
+_MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12
+}
 
 
-import re
+@lru_cache(maxsize=4096)
+def parse_locomo_session_time(s):
+    # Hand parser for "%I:%M %p on %d %B, %Y" (e.g. "1:56 pm on 8 May, 2023");
+    # strptime re-parses the format and goes through locale tables on every call.
+    try:
+        hm, ampm, on, day, month, year = s.replace(",", " ").split()
+        h, m = hm.split(":")
+        hour = int(h)
+        ampm = ampm.upper()
+        if on != "on" or ampm not in ("AM", "PM") or not 1 <= hour <= 12:
+            raise ValueError
+        hour = hour % 12 + (12 if ampm == "PM" else 0)
+        return datetime(int(year), _MONTHS[month.lower()], int(day), hour, int(m))
+    except (ValueError, KeyError):
+        raise ValueError(f"time data {s!r} does not match format '%I:%M %p on %d %B, %Y'") from None
+
 
 _NUM_WORD = {
     "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
     "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12
 }
 
+_GAP_RE = re.compile(
+    r"\b(\d+|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|a|an)\b\s*(week|weeks|month|months|year|years)\b"
+)
+
+
+@lru_cache(maxsize=512)
 def parse_time_gap(time_gap):
     s = time_gap.lower().strip()
 
-    m = re.search(r"\b(a|an|about|around|approximately|approx\.?)\b", s)
-    if m:
-        approx = True
-    else:
-        approx = False
-
-    m = re.search(r"\b(\d+|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|a|an)\b\s*(week|weeks|month|months|year|years)\b", s)
+    m = _GAP_RE.search(s)
     if not m:
         return 0
 
@@ -47,45 +64,43 @@ def parse_time_gap(time_gap):
     return 0
 
 
-def parse_ab_dialogue(text):
+def parse_ab_dialogue_mapped(text, speaker_a, speaker_b):
     turns = []
     for line in text.split("\n"):
         line = line.strip()
-        if line.startswith("A:"):
-            turns.append({"speaker": "A", "text": line[2:].strip()})
-        elif line.startswith("B:"):
-            turns.append({"speaker": "B", "text": line[2:].strip()})
-    return turns
-
-
-def map_speaker(dialogue, speaker_a, speaker_b):
-    out = []
-    for t in dialogue:
-        x = copy.deepcopy(t)
-        if x["speaker"] == "A":
-            x["speaker"] = speaker_a
+        if len(line) < 2 or line[1] != ":":
+            continue
+        c = line[0]
+        if c == "A":
+            speaker = speaker_a
+        elif c == "B":
+            speaker = speaker_b
         else:
-            x["speaker"] = speaker_b
-        out.append(x)
-    return out
+            continue
+        turns.append({"speaker": speaker, "text": line[2:].lstrip()})
+    return turns
 
 
 def analyze_conversation(conv):
     speaker_a = conv["speaker_a"]
     speaker_b = conv["speaker_b"]
 
+    # One scan over the keys; "session_N_date_time" keys fail the isdecimal check.
+    session_pairs = []
+    for k, v in conv.items():
+        if k.startswith("session_") and k[8:].isdecimal():
+            session_pairs.append((int(k[8:]), k, v))
+    session_pairs.sort(key=lambda p: p[0])
+
     sessions = []
     session_times = []
 
-    idx = 1
-    while True:
-        sk = f"session_{idx}"
-        tk = f"session_{idx}_date_time"
-        if sk not in conv:
+    # Sessions are numbered from 1; stop at the first gap.
+    for expected, (idx, sk, sess) in enumerate(session_pairs, 1):
+        if idx != expected:
             break
-        sessions.append(conv[sk])
-        session_times.append(parse_locomo_session_time(conv[tk]))
-        idx += 1
+        sessions.append(sess)
+        session_times.append(parse_locomo_session_time(conv[sk + "_date_time"]))
 
     return speaker_a, speaker_b, sessions, session_times
 
@@ -105,57 +120,67 @@ def compute_insertion(session_times, time_gap):
     return cue_idx, cue_time, query_time
 
 
-def build_context(plus_item, locomo_item):
-    conv = locomo_item["conversation"]
+def stitch_sessions(sessions, cue_idx, cue_turns, query_turns):
+    # Sessions are chronological and compute_insertion already located the cue,
+    # so insert directly: cue after session cue_idx (or first if it predates all
+    # sessions), query last since query_time is after the final session.
+    stitched = []
+    if cue_idx is None:
+        stitched.extend(cue_turns)
+
+    for i, sess in enumerate(sessions):
+        stitched.extend(sess)
+        if i == cue_idx:
+            stitched.extend(cue_turns)
+
+    stitched.extend(query_turns)
+    return stitched
+
 
-    speaker_a, speaker_b, sessions, session_times = analyze_conversation(conv)
+def build_stitched_dialogue(plus_item, locomo_item, parsed=None):
+    # Same dialogue as build_context(...)["dialogue"], without the metadata.
+    if parsed is None:
+        parsed = analyze_conversation(locomo_item["conversation"])
+
+    speaker_a, speaker_b, sessions, session_times = parsed
+
+    cue_idx, _, _ = compute_insertion(session_times, plus_item["time_gap"])
+
+    return stitch_sessions(
+        sessions,
+        cue_idx,
+        parse_ab_dialogue_mapped(plus_item["cue_dialogue"], speaker_a, speaker_b),
+        parse_ab_dialogue_mapped(plus_item["trigger_query"], speaker_a, speaker_b)
+    )
+
+
+def build_context(plus_item, locomo_item, parsed=None):
+    # parsed: optional analyze_conversation() result for locomo_item, so callers
+    # stitching many plus items onto one conversation only parse it once.
+    if parsed is None:
+        parsed = analyze_conversation(locomo_item["conversation"])
+
+    speaker_a, speaker_b, sessions, session_times = parsed
 
     cue_idx, cue_time, query_time = compute_insertion(
         session_times,
         plus_item["time_gap"]
     )
 
-    cue_turns = map_speaker(
-        parse_ab_dialogue(plus_item["cue_dialogue"]),
+    cue_turns = parse_ab_dialogue_mapped(
+        plus_item["cue_dialogue"],
         speaker_a,
         speaker_b
     )
 
-    query_turns = map_speaker(
-        parse_ab_dialogue(plus_item["trigger_query"]),
+    query_turns = parse_ab_dialogue_mapped(
+        plus_item["trigger_query"],
         speaker_a,
         speaker_b
     )
 
-    cue_anchor = None
-    if cue_idx is not None:
-        cue_anchor = sessions[cue_idx][-1]
-
-    query_anchor = sessions[-1][-1]
-
-    events = []
+    stitched = stitch_sessions(sessions, cue_idx, cue_turns, query_turns)
 
-    for sess, t in zip(sessions, session_times):
-        events.append((t, sess))
-
-    events.append((cue_time, cue_turns))
-    events.append((query_time, query_turns))
-
-    events.sort(key=lambda x: x[0])
-
-    stitched = []
-    for _, content in events:
-        stitched.extend(content)
-
-    # stitched = []
-
-    # for i, sess in enumerate(sessions):
-    #     stitched.extend(sess)
-    #     if cue_idx is not None and i == cue_idx:
-    #         stitched.extend(cue_turns)
-
-    # stitched.extend(query_turns)
-    # import pdb; pdb.set_trace()
     return {
         "speaker_a": speaker_a,
         "speaker_b": speaker_b,
@@ -176,11 +201,13 @@ if __name__ == "__main__":
     with open("../data/locomo10.json", "r") as f:
         locomo_raw = json.load(f)
 
+    locomo_parsed = [analyze_conversation(item["conversation"]) for item in locomo_raw]
+
     outputs = []
 
     for plus in locomo_plus:
-        locomo_item = random.choice(locomo_raw)
-        ctx = build_context(plus, locomo_item)
+        j = random.randrange(len(locomo_raw))
+        ctx = build_context(plus, locomo_raw[j], locomo_parsed[j])
         outputs.append(ctx)
 
     with open("stitched_contexts.json", "w") as f:
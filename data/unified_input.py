@@ -7,7 +7,7 @@ Merges:
 
 input_prompt build logic (different by source):
 - Locomo (5 categories): conversation as-is + question (no insertion).
-- Locomo_plus (Cognitive): same as build_conv.py — (1) map A/B to the conversation’s speaker names (map_speaker), (2) parse time_gap and insert cue_dialogue and trigger_query at the correct positions (compute_insertion, events sorted by time); build_context returns the stitched dialogue used as input_prompt.
+- Locomo_plus (Cognitive): same as build_conv.py — (1) map A/B to the conversation’s speaker names (parse_ab_dialogue_mapped), (2) parse time_gap and insert cue_dialogue and trigger_query at the correct positions (compute_insertion); build_context returns the stitched dialogue used as input_prompt.
 
 Output fields per sample:
 - input_prompt: full dialogue (+ question for Locomo) text (for inspection only; not saved at final model input).
@@ -45,21 +45,18 @@ def _evidence_to_text(conversation: dict, evidence_list: list) -> str:
     """Convert list of 'Dn:k' to 'Speaker: text' lines (no Dn:k prefix)."""
     lines = []
     for evid in evidence_list:
-        try:
-            session_id, turn_id = evid.split(":")
-            session_idx = int(session_id.replace("D", ""))
-            turn_idx = int(turn_id)
-            session_key = f"session_{session_idx}"
-            turns = conversation.get(session_key, [])
-            if 0 <= turn_idx - 1 < len(turns):
-                turn = turns[turn_idx - 1]
-                speaker = turn.get("speaker", "Unknown")
-                text = turn.get("text", "")
-                lines.append(f"{speaker}：{text}")
-            else:
-                lines.append(f"[{evid}] [Missing turn]")
-        except Exception:
+        session_id, _, turn_id = evid.partition(":")
+        session_num = session_id[1:] if session_id.startswith("D") else session_id
+        if not (session_num.isdecimal() and turn_id.isdecimal()):
             lines.append(f"[{evid}] [Parse error]")
+            continue
+        turns = conversation.get(f"session_{int(session_num)}", [])
+        turn_idx = int(turn_id)
+        if 0 < turn_idx <= len(turns):
+            turn = turns[turn_idx - 1]
+            lines.append(f'{turn.get("speaker", "Unknown")}：{turn.get("text", "")}')
+        else:
+            lines.append(f"[{evid}] [Missing turn]")
     return "\n".join(lines)
 
 
@@ -69,20 +66,20 @@ def _build_conversation_context(conversation: dict) -> str:
         [k for k in conversation.keys() if k.startswith("session_") and not k.endswith("_date_time")],
         key=lambda x: int(x.split("_")[-1]),
     )
-    context = ""
-    for s in sessions:
-        date = conversation.get(f"{s}_date_time", "")
-        turns = conversation.get(s, [])
-        context += f"DATE: {date}\nCONVERSATION:\n"
+    sess_data = [(conversation.get(f"{s}_date_time", ""), conversation.get(s, [])) for s in sessions]
+    parts = []
+    append = parts.append
+    for date, turns in sess_data:
+        append(f"DATE: {date}\nCONVERSATION:\n")
         for d in turns:
             speaker = d.get("speaker", "?")
             text = (d.get("text") or "").strip()
             if "blip_caption" in d:
-                context += f'{speaker} said, "{text}" and shared {d["blip_caption"]}.\n'
+                append(f'{speaker} said, "{text}" and shared {d["blip_caption"]}.\n')
             else:
-                context += f'{speaker} said, "{text}"\n'
-        context += "\n"
-    return context
+                append(f'{speaker} said, "{text}"\n')
+        append("\n")
+    return "".join(parts)
 
 
 # Locomo original 5 categories (by id in data).
@@ -107,7 +104,8 @@ def _process_locomo(locomo_path: str) -> list:
     for item in raw:
         conv = item.get("conversation") or {}
         qa_list = item.get("qa") or []
-        ctx_text = _build_conversation_context(conv)
+        # Build: dialogue only + question (no insertion).
+        prompt_prefix = _build_conversation_context(conv).rstrip() + "\n\nQuestion: "
 
         for qa in qa_list:
             question = qa.get("question", "")
@@ -118,8 +116,7 @@ def _process_locomo(locomo_path: str) -> list:
             evidence_list = _parse_evidence_list(evidence_raw)
             evidence_text = _evidence_to_text(conv, evidence_list)
 
-            # Build: dialogue only + question (no insertion).
-            input_prompt = ctx_text.rstrip() + "\n\nQuestion: " + question
+            input_prompt = prompt_prefix + question
 
             sample = {
                 "input_prompt": input_prompt,
@@ -139,28 +136,30 @@ def _process_locomo(locomo_path: str) -> list:
 def _cue_dialogue_to_evidence(cue_dialogue: str, locomo_item: dict) -> str:
     """
     Cognitive evidence: cue_dialogue only (no trigger_query), with A/B replaced by
-    the conversation's speaker names (same as build_conv.map_speaker) for LLM-as-a-judge input.
+    the conversation's speaker names (same as build_conv.parse_ab_dialogue_mapped) for LLM-as-a-judge input.
     """
-    from build_conv import parse_ab_dialogue, map_speaker
+    from build_conv import parse_ab_dialogue_mapped
 
     conv = locomo_item.get("conversation") or {}
     speaker_a = conv.get("speaker_a", "A")
     speaker_b = conv.get("speaker_b", "B")
-    turns = map_speaker(parse_ab_dialogue(cue_dialogue or ""), speaker_a, speaker_b)
-    return "\n".join(f'{t["speaker"]}：{t["text"].strip()}' for t in turns if t.get("text"))
+    # Parsed turns always carry stripped "speaker"/"text", so index directly.
+    turns = parse_ab_dialogue_mapped(cue_dialogue or "", speaker_a, speaker_b)
+    return "\n".join(f'{t["speaker"]}：{t["text"]}' for t in turns if t["text"])
 
 
-def _stitch_dialogue_for_plus(plus_item: dict, locomo_item: dict) -> str:
+def _stitch_dialogue_for_plus(plus_item: dict, locomo_item: dict, parsed=None) -> str:
     """
-    Cognitive: input_prompt = stitched dialogue from build_conv.build_context.
-    Follows build_conv.py: (1) A/B replaced with conversation’s speaker_a/speaker_b (map_speaker);
-    (2) time_gap parsed and cue/query inserted at the right positions (compute_insertion, sort by time).
-    We only format the returned 'dialogue' as text (Speaker said, "...").
+    Cognitive: input_prompt = stitched dialogue from build_conv.build_stitched_dialogue
+    (the 'dialogue' of build_conv.build_context, without its metadata).
+    Follows build_conv.py: (1) A/B replaced with conversation’s speaker_a/speaker_b (parse_ab_dialogue_mapped);
+    (2) time_gap parsed and cue/query inserted at the right positions (compute_insertion).
+    We only format the dialogue as text (Speaker said, "...").
+    parsed: optional build_conv.analyze_conversation result for locomo_item.
     """
-    from build_conv import build_context
+    from build_conv import build_stitched_dialogue
 
-    ctx = build_context(plus_item, locomo_item)
-    dialogue = ctx.get("dialogue") or []
+    dialogue = build_stitched_dialogue(plus_item, locomo_item, parsed)
     lines = []
     for turn in dialogue:
         speaker = turn.get("speaker", "?")
@@ -171,6 +170,8 @@ def _stitch_dialogue_for_plus(plus_item: dict, locomo_item: dict) -> str:
 
 def _process_locomo_plus(locomo_plus_path: str, locomo_path: str, plus_sample_size=None) -> list:
     """Cognitive (sixth): stitching via build_conv.build_context; no answer."""
+    from build_conv import analyze_conversation
+
     with open(locomo_plus_path, "r", encoding="utf-8") as f:
         plus_list = json.load(f)
     with open(locomo_path, "r", encoding="utf-8") as f:
@@ -179,11 +180,17 @@ def _process_locomo_plus(locomo_plus_path: str, locomo_path: str, plus_sample_si
     if plus_sample_size is not None:
         plus_list = plus_list[:plus_sample_size]
 
+    # Each Locomo conversation is parsed once and reused across the plus items cycled onto it.
+    locomo_parsed = [None] * len(locomo_list)
+
     out = []
     for i, plus in enumerate(plus_list):
-        locomo_item = locomo_list[i % len(locomo_list)]
+        j = i % len(locomo_list)
+        locomo_item = locomo_list[j]
         try:
-            input_prompt = _stitch_dialogue_for_plus(plus, locomo_item)
+            if locomo_parsed[j] is None:
+                locomo_parsed[j] = analyze_conversation(locomo_item["conversation"])
+            input_prompt = _stitch_dialogue_for_plus(plus, locomo_item, locomo_parsed[j])
         except Exception:
             input_prompt = ""
 
@@ -10,9 +10,9 @@ Flow:
 """
 
 import argparse
-import json
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 from pathlib import Path
 
 try:
@@ -28,21 +28,27 @@ if str(_root) not in sys.path:
     sys.path.insert(0, str(_root))
 
 from task_eval.utils import (
-    load_unified_samples,
+    iter_unified_samples,
     call_model,
+    call_model_batch,
     build_output_record,
     extract_question_from_input_prompt,
+    write_json,
 )
 
 
+def _question_input(sample) -> str:
+    """Question shown in the record: trigger for Cognitive, else the question in input_prompt."""
+    if sample.get("category", "") == "Cognitive":
+        return (sample.get("trigger") or "").strip() or "Context dialogue (cue awareness)"
+    return extract_question_from_input_prompt(sample.get("input_prompt", ""))
+
+
 def _process_one_sample(sample, args):
     """Process one sample and return one record (for concurrent or sequential use)."""
     input_prompt = sample.get("input_prompt", "")
     category = sample.get("category", "")
-    if category == "Cognitive":
-        question_input = (sample.get("trigger") or "").strip() or "Context dialogue (cue awareness)"
-    else:
-        question_input = extract_question_from_input_prompt(input_prompt)
+    question_input = _question_input(sample)
 
     if not input_prompt:
         return build_output_record(
@@ -65,27 +71,69 @@ def _process_one_sample(sample, args):
     )
 
 
+def _process_batch(batch, args):
+    """Process a list of samples with one call_model_batch request; return records in input order."""
+    pending = [s for s in batch if s.get("input_prompt")]
+    predictions = iter(call_model_batch(
+        [s["input_prompt"] for s in pending],
+        model=args.model,
+        backend=args.backend,
+        categories=[s.get("category", "") for s in pending],
+        temperature=args.temperature,
+        max_tokens=args.max_tokens,
+    ) if pending else [])
+
+    records = []
+    for sample in batch:
+        prediction = next(predictions) if sample.get("input_prompt") else "(no input_prompt)"
+        records.append(build_output_record(
+            sample, prediction, args.model, question_input=_question_input(sample)
+        ))
+    return records
+
+
+def _batched(iterable, n):
+    """Yield lists of up to n consecutive items."""
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
 def evaluate_dataset(args):
     out_path = Path(args.out_file)
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    samples = load_unified_samples(args.data_file)
+    # Samples are streamed from the input file, so work starts before it is fully parsed.
+    samples = iter_unified_samples(args.data_file)
     concurrency = max(1, int(args.concurrency))
 
+    # call_vllm takes a whole batch of prompts per request; concurrency then applies to batches.
+    batched = args.backend == "call_vllm"
+    if batched:
+        units = _batched(samples, max(1, int(args.batch_size)))
+        worker = _process_batch
+    else:
+        units = samples
+        worker = _process_one_sample
+
     if concurrency <= 1:
-        results = []
-        for sample in tqdm(samples, desc=f"Evaluating {args.model}"):
-            results.append(_process_one_sample(sample, args))
+        outputs = []
+        for unit in tqdm(units, desc=f"Evaluating {args.model}"):
+            outputs.append(worker(unit, args))
     else:
-        results = [None] * len(samples)
         with ThreadPoolExecutor(max_workers=concurrency) as executor:
-            future_to_idx = {executor.submit(_process_one_sample, s, args): i for i, s in enumerate(samples)}
-            for future in tqdm(as_completed(future_to_idx), total=len(samples), desc=f"Evaluating {args.model}"):
+            future_to_idx = {executor.submit(worker, u, args): i for i, u in enumerate(units)}
+            outputs = [None] * len(future_to_idx)
+            for future in tqdm(as_completed(future_to_idx), total=len(future_to_idx), desc=f"Evaluating {args.model}"):
                 idx = future_to_idx[future]
-                results[idx] = future.result()
+                outputs[idx] = future.result()
+
+    results = [r for batch in outputs for r in batch] if batched else outputs
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    write_json(out_path, results)
 
     print(f"Wrote {len(results)} records to {out_path}")
 
@@ -106,6 +154,8 @@ if __name__ == "__main__":
     parser.add_argument("--max-tokens", type=int, default=1024, dest="max_tokens",
                         help="Max tokens for call_llm (default: 1024)")
     parser.add_argument("--concurrency", type=int, default=10,
-                        help="Max concurrent requests for call_llm/call_vllm (default: 1)")
+                        help="Max concurrent requests for call_llm/call_vllm (default: 10)")
+    parser.add_argument("--batch-size", type=int, default=64, dest="batch_size",
+                        help="Prompts per generate pass for call_vllm (default: 64)")
     args = parser.parse_args()
     evaluate_dataset(args)
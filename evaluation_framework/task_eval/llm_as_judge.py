@@ -7,9 +7,9 @@ Scoring: correct=1, partial=0.5, wrong=0.
 import argparse
 import json
 import re
-from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from string import Formatter
 
 try:
     from tqdm import tqdm
@@ -23,16 +23,53 @@ if str(_root) not in sys.path:
     sys.path.insert(0, str(_root))
 
 from task_eval.prompt import PROMPT_TEMPLATES
-from task_eval.utils import call_model
+from task_eval.utils import call_model, call_model_batch, read_json, write_json
 
 # Scoring: correct=1, partial=0.5, wrong=0
 LABEL_TO_SCORE = {"correct": 1.0, "partial": 0.5, "wrong": 0.0}
 
+# {"label": ..., "reason": ...} block embedded anywhere in the judge output
+_JUDGE_JSON_RE = re.compile(
+    r'\{[^{}]*"label"\s*:\s*["\']([^"\']+)["\'][^{}]*"reason"\s*:\s*["\']([^"\']*)["\']',
+    re.DOTALL,
+)
+
+
+def _compile_template(template: str) -> tuple:
+    """Split a judge template once into (literal, None) / (None, field) parts ({{ }} already unescaped)."""
+    parts = []
+    for literal, field, _, _ in Formatter().parse(template):
+        if literal:
+            parts.append((literal, None))
+        if field is not None:
+            parts.append((None, field))
+    return tuple(parts)
+
+
+# Pre-split templates: filling one is plain concatenation, with no per-call format-string parsing.
+_COMPILED_TEMPLATES = {cat: _compile_template(t) for cat, t in PROMPT_TEMPLATES.items()}
+
+
+def _static_prefix(parts: tuple) -> str:
+    """Instructions of a judge template: everything before the blank line that opens its input fields."""
+    head = ""
+    for literal, field in parts:
+        if field is not None:
+            break
+        head += literal
+    static, sep, _ = head.rpartition("\n\n")
+    return static + sep
+
+
+# Static part of each judge template, sent as the system message so the provider can cache it across calls.
+_STATIC_PREFIX = {cat: _static_prefix(parts) for cat, parts in _COMPILED_TEMPLATES.items()}
+
 
 def get_judge_prompt(category: str, evidence: str, pred: str, gold: str = "") -> str:
     """Get template from prompt.PROMPT_TEMPLATES by category and fill gold/pred/evidence. Cognitive has no gold."""
-    template = PROMPT_TEMPLATES.get(category) or PROMPT_TEMPLATES["default"]
-    return template.format(gold=gold or "", pred=pred or "", evidence=evidence or "")
+    parts = _COMPILED_TEMPLATES.get(category) or _COMPILED_TEMPLATES["default"]
+    values = {"gold": str(gold or ""), "pred": str(pred or ""), "evidence": str(evidence or "")}
+    return "".join(literal if field is None else values[field] for literal, field in parts)
 
 
 def label_to_score(label: str) -> float:
@@ -42,62 +79,141 @@ def label_to_score(label: str) -> float:
 
 def _parse_judge_response(raw: str) -> tuple:
     """Parse label and reason from model output; return (label, reason)."""
-    label, reason = "", ""
     raw = (raw or "").strip()
-    try:
-        # Try JSON block first
-        m = re.search(r'\{[^{}]*"label"\s*:\s*["\']([^"\']+)["\'][^{}]*"reason"\s*:\s*["\']([^"\']*)["\']', raw, re.DOTALL)
+    if not raw:
+        return "", ""
+    # Outputs without any brace cannot hold a JSON block; go straight to keywords.
+    if "{" in raw:
+        if raw[0] == "{":
+            try:
+                obj = json.loads(raw)
+                return (obj.get("label") or "").strip(), (obj.get("reason") or "").strip()
+            except (ValueError, AttributeError):
+                pass
+        # JSON block embedded in prose or a code fence
+        m = _JUDGE_JSON_RE.search(raw)
         if m:
-            label, reason = m.group(1).strip(), (m.group(2) or "").strip()
-        else:
-            obj = json.loads(raw)
-            label = (obj.get("label") or "").strip()
-            reason = (obj.get("reason") or "").strip()
-    except Exception:
-        if "correct" in raw.lower():
-            label = "correct"
-        elif "wrong" in raw.lower():
-            label = "wrong"
-        elif "partial" in raw.lower():
-            label = "partial"
-        reason = raw[:200] if raw else ""
-    return label, reason
+            return m.group(1).strip(), (m.group(2) or "").strip()
+    label = ""
+    lowered = raw.lower()
+    if "correct" in lowered:
+        label = "correct"
+    elif "wrong" in lowered:
+        label = "wrong"
+    elif "partial" in lowered:
+        label = "partial"
+    return label, raw[:200]
 
 
-def _judge_one_record(record: dict, args) -> dict:
-    """Run judge on one record; return record with judge_label and judge_reason."""
-    r = dict(record)
-    cat = r.get("category") or "default"
-    evidence = r.get("evidence", "")
-    pred = r.get("prediction", "")
-    gold = r.get("ground_truth") or r.get("answer", "") or ""
+# Adversarial predictions that consist only of a plain refusal (after _normalize_prediction): the judge
+# labels these correct, so no call is needed. Anything else, including refusals with a hedge or an answer
+# attached, still goes to the judge.
+_REFUSAL_PREDICTIONS = frozenset({
+    "not mentioned",
+    "not mentioned in the conversation",
+    "this was not mentioned in the conversation",
+    "this is not mentioned in the conversation",
+    "it was not mentioned in the conversation",
+    "it is not mentioned in the conversation",
+    "this information is not mentioned in the conversation",
+    "this information is not available in the conversation",
+    "the conversation does not mention this",
+    "the conversation does not contain this information",
+    "there is no information about this in the conversation",
+    "this cannot be answered from the conversation",
+    "this question cannot be answered from the conversation",
+})
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize_prediction(pred: str) -> str:
+    """Lowercase, collapse whitespace and drop surrounding quotes and trailing punctuation."""
+    pred = _WHITESPACE_RE.sub(" ", (pred or "").replace("\u2019", "'")).strip().lower()
+    return pred.strip("\"'").rstrip(".!").strip()
+
+
+def _quick_judgment(record: dict):
+    """Judge output for an adversarial prediction that is exactly a plain refusal, else None (use the judge)."""
+    if record.get("category") == "adversarial" and _normalize_prediction(record.get("prediction")) in _REFUSAL_PREDICTIONS:
+        return '{"label": "correct", "reason": "The prediction states the information was not mentioned."}'
+    return None
+
+
+def _judge_request(record: dict) -> tuple:
+    """Judge request for one record: (user content with the inputs, static system instructions)."""
+    cat = record.get("category") or "default"
+    evidence = record.get("evidence", "")
+    pred = record.get("prediction", "")
+    gold = record.get("ground_truth") or record.get("answer", "") or ""
 
     prompt = get_judge_prompt(cat, evidence, pred, gold)
+    system = _STATIC_PREFIX.get(cat) or _STATIC_PREFIX["default"]
+    return prompt[len(system):], system
+
+
+def _with_judgment(record: dict, raw: str) -> dict:
+    """Copy of record with judge_label, judge_reason and judge_score parsed from the judge output."""
+    r = dict(record)
+    label, reason = _parse_judge_response(raw)
+    r["judge_label"] = label
+    r["judge_reason"] = reason
+    r["judge_score"] = label_to_score(label)
+    return r
+
+
+def _judge_one_record(record: dict, args) -> dict:
+    """Run judge on one record; return record with judge_label and judge_reason."""
+    quick = _quick_judgment(record)
+    if quick is not None:
+        return _with_judgment(record, quick)
+    content, system = _judge_request(record)
     raw = call_model(
-        prompt,
+        content,
         model=args.model,
         backend=args.backend,
         temperature=args.temperature,
         max_tokens=args.max_tokens,
+        system=system,
     )
-    label, reason = _parse_judge_response(raw)
-    score = label_to_score(label)
-    r["judge_label"] = label
-    r["judge_reason"] = reason
-    r["judge_score"] = score
-    return r
+    return _with_judgment(record, raw)
+
+
+def _judge_batch(records: list, args) -> list:
+    """Run judge on all records with one call_model_batch (call_llm: async, up to --concurrency in flight)."""
+    raws = [_quick_judgment(r) for r in records]
+    pending = [i for i, raw in enumerate(raws) if raw is None]
+    requests = [_judge_request(records[i]) for i in pending]
+    responses = call_model_batch(
+        [content for content, _ in requests],
+        model=args.model,
+        backend=args.backend,
+        systems=[system for _, system in requests],
+        concurrency=max(1, int(args.concurrency)),
+        desc="Judge",
+        temperature=args.temperature,
+        max_tokens=args.max_tokens,
+    )
+    for i, raw in zip(pending, responses):
+        raws[i] = raw
+    return [_with_judgment(r, raw) for r, raw in zip(records, raws)]
 
 
 def _compute_summary(results: list) -> dict:
     """Aggregate scores by sample and category. Returns {total_score, total_samples, by_category: {...}}."""
+    # One pass over the records, with flat per-category count and score dicts.
     total_score = 0.0
-    by_cat = defaultdict(lambda: {"score": 0.0, "count": 0})
+    counts = {}
+    sums = {}
     for r in results:
         s = float(r.get("judge_score", 0.0))
         total_score += s
         cat = r.get("category") or "default"
-        by_cat[cat]["score"] += s
-        by_cat[cat]["count"] += 1
+        if cat in counts:
+            counts[cat] += 1
+            sums[cat] += s
+        else:
+            counts[cat] = 1
+            sums[cat] = s
     summary = {
         "total_score": round(total_score, 2),
         "total_samples": len(results),
@@ -105,12 +221,12 @@ def _compute_summary(results: list) -> dict:
         "overall_avg": round(total_score / len(results), 4) if results else 0.0,
         "by_category": {},
     }
-    for cat, v in sorted(by_cat.items()):
-        n = v["count"]
+    for cat in sorted(counts):
+        n = counts[cat]
         summary["by_category"][cat] = {
-            "score": round(v["score"], 2),
+            "score": round(sums[cat], 2),
             "count": n,
-            "avg": round(v["score"] / n, 4) if n else 0.0,
+            "avg": round(sums[cat] / n, 4) if n else 0.0,
         }
     return summary
 
@@ -131,14 +247,16 @@ def _print_summary(summary: dict) -> None:
 
 
 def run_judge(args):
-    with open(args.input_file, "r", encoding="utf-8") as f:
-        records = json.load(f)
+    records = read_json(args.input_file)
 
     out_path = Path(args.out_file)
     out_path.parent.mkdir(parents=True, exist_ok=True)
     concurrency = max(1, int(args.concurrency))
 
-    if concurrency <= 1:
+    if args.backend == "call_llm" and concurrency > 1:
+        print(f"Judging {len(records)} records ({concurrency} concurrent requests)...")
+        results = _judge_batch(records, args)
+    elif concurrency <= 1:
         results = []
         for r in tqdm(records, desc="Judge"):
             results.append(_judge_one_record(r, args))
@@ -150,8 +268,7 @@ def run_judge(args):
                 idx = future_to_idx[future]
                 results[idx] = future.result()
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    write_json(out_path, results)
     print(f"Wrote {len(results)} judged records to {out_path}")
 
     summary = _compute_summary(results)
@@ -159,8 +276,7 @@ def run_judge(args):
     if args.summary_file:
         summary_path = Path(args.summary_file)
         summary_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(summary_path, "w", encoding="utf-8") as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2)
+        write_json(summary_path, summary)
         print(f"Summary written to {summary_path}")
 
 
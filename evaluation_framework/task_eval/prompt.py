@@ -1,6 +1,8 @@
 """
 Judge prompts for six categories: multi-hop, temporal, common-sense, single-hop, adversarial, Cognitive.
 Used by LLM-as-a-judge (v2) for evaluation.
+Each template puts its static instructions and output format first and the {gold}/{pred}/{evidence}
+inputs last, so every judge call for a category shares a byte-identical prefix (provider prompt caching).
 """
 
 CONV_START_PROMPT = (
@@ -20,6 +22,9 @@ Labels:
 - "partial": The answer misses some details or contains minor inaccuracies but gets the main entity right.
 - "wrong": The answer is factually incorrect or hallucinates details not in the reference.
 
+Return your judgment strictly in JSON format:
+{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
+
 Reference Answer:
 {gold}
 
@@ -28,9 +33,6 @@ Model Prediction:
 
 Relevant Evidence:
 {evidence}
-
-Return your judgment strictly in JSON format:
-{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
 """,
 
     "single-hop": """
@@ -42,6 +44,9 @@ Labels:
 - "partial": The answer misses some details but gets the main entity right.
 - "wrong": The answer is factually incorrect or hallucinates details not in the reference.
 
+Return your judgment strictly in JSON format:
+{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
+
 Reference Answer:
 {gold}
 
@@ -50,9 +55,6 @@ Model Prediction:
 
 Relevant Evidence:
 {evidence}
-
-Return your judgment strictly in JSON format:
-{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
 """,
 
     "temporal": """
@@ -63,6 +65,9 @@ Labels:
 - "correct": The calculated time, duration, or date matches the reference exactly (semantic equivalents are allowed).
 - "wrong": The calculation is incorrect, the sequence is reversed, or the specific time is wrong.
 
+Return your judgment strictly in JSON format:
+{{"label": "correct"|"wrong", "reason": "<short explanation>"}}
+
 Reference Answer:
 {gold}
 
@@ -71,9 +76,6 @@ Model Prediction:
 
 Relevant Evidence:
 {evidence}
-
-Return your judgment strictly in JSON format:
-{{"label": "correct"|"wrong", "reason": "<short explanation>"}}
 """,
 
     "common-sense": """
@@ -85,6 +87,9 @@ Labels:
 - "partial": The reasoning is mostly correct but the final conclusion is vague or slightly off.
 - "wrong": The reasoning contradicts commonsense or the reference.
 
+Return your judgment strictly in JSON format:
+{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
+
 Reference Answer:
 {gold}
 
@@ -93,9 +98,6 @@ Model Prediction:
 
 Relevant Evidence:
 {evidence}
-
-Return your judgment strictly in JSON format:
-{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
 """,
 
     "adversarial": """
@@ -108,11 +110,11 @@ Labels:
 - "wrong": The prediction does NOT convey that meaning—e.g., it gives a concrete answer or does not refuse. Do not score.
 
 
-Model Prediction:
-{pred}
-
 Return your judgment strictly in JSON format:
 {{"label": "correct"|"wrong", "reason": "<short explanation>"}}
+
+Model Prediction:
+{pred}
 """,
 
     "Cognitive": """
@@ -123,14 +125,14 @@ Labels:
 - "correct": The prediction explicitly or implicitly reflects/uses the evidence (memory or constraint). Give 1 point.
 - "wrong": The prediction does not show such a link to the evidence. No point.
 
+Return your judgment strictly in JSON format:
+{{"label": "correct"|"wrong", "reason": "<Does the prediction relate to the evidence?>"}}
+
 Memory/Evidence:
 {evidence}
 
 Model Prediction:
 {pred}
-
-Return your judgment strictly in JSON format:
-{{"label": "correct"|"wrong", "reason": "<Does the prediction relate to the evidence?>"}}
 """,
 
     "default": """
@@ -142,6 +144,9 @@ Labels:
 - "partial": Contains correct info but is incomplete.
 - "wrong": Factually incorrect.
 
+Return your judgment strictly in JSON format:
+{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
+
 Reference Answer:
 {gold}
 
@@ -150,8 +155,5 @@ Model Prediction:
 
 Relevant Evidence:
 {evidence}
-
-Return your judgment strictly in JSON format:
-{{"label": "correct"|"partial"|"wrong", "reason": "<short explanation>"}}
 """,
 }
@@ -5,10 +5,31 @@ Evaluation framework utils.
 - All inputs to LLM/vLLM are prefixed with CONV_START_PROMPT before calling.
 """
 
+import asyncio
+import hashlib
 import json
 import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
 # Prefix prepended to all LLM/vLLM inputs
 CONV_START_PROMPT = (
     "Below is a conversation between two people: {} and {}. "
@@ -35,12 +56,15 @@ def _get_task_instruction(category: str) -> str:
     return INSTRUCTION_QA
 
 
+@lru_cache(maxsize=64)
+def _model_input_prefix(name1: str, name2: str, category: str) -> str:
+    """CONV_START prefix + task instruction; identical for every sample of a category."""
+    return CONV_START_PROMPT.format(name1, name2) + _get_task_instruction(category)
+
+
 def _build_model_input(input_prompt: str, category: str = "", name1: str = "A", name2: str = "B") -> str:
-    """Build: CONV_START prefix + task instruction + user input_prompt."""
-    conv = CONV_START_PROMPT.format(name1, name2)
-    instruction = _get_task_instruction(category)
-    body = (input_prompt or "").strip()
-    return conv + instruction + (body if body else "")
+    """Build: CONV_START prefix + task instruction + user input_prompt (already stripped by iter_unified_samples)."""
+    return _model_input_prefix(name1, name2, (category or "").strip()) + (input_prompt or "")
 
 
 def _prepend_conv_prefix(text: str, name1: str = "A", name2: str = "B") -> str:
@@ -50,20 +74,64 @@ def _prepend_conv_prefix(text: str, name1: str = "A", name2: str = "B") -> str:
     return CONV_START_PROMPT.format(name1, name2) + (text or "").strip()
 
 
-def load_unified_samples(data_file: str):
+def _normalize_sample(sample):
+    """Strip input_prompt once here so per-call prompt building does not redo it."""
+    if isinstance(sample, dict) and sample.get("input_prompt"):
+        sample["input_prompt"] = sample["input_prompt"].strip()
+    return sample
+
+
+def _iter_samples(path: Path):
+    if ijson is not None:
+        with open(path, "rb") as f:
+            for sample in ijson.items(f, "item", use_float=True):
+                yield _normalize_sample(sample)
+        return
+    data = read_json(path)
+    if not isinstance(data, list):
+        raise ValueError("Unified input JSON must be a list of samples.")
+    for sample in data:
+        yield _normalize_sample(sample)
+
+
+def iter_unified_samples(data_file: str):
     """
-    Load samples from the unified input JSON (unified_input_samples.json).
-    Each sample has: input_prompt, evidence, category, optional answer, optional time_gap.
-    Returns list of dicts.
+    Iterate samples from the unified input JSON (unified_input_samples.json) without loading the whole file
+    when ijson is installed (falls back to read_json otherwise).
+    Each sample has: input_prompt (stripped), evidence, category, optional answer, optional time_gap.
     """
     path = Path(data_file)
     if not path.exists():
         raise FileNotFoundError(f"Unified input file not found: {data_file}")
+    return _iter_samples(path)
+
+
+def load_unified_samples(data_file: str):
+    """
+    Load samples from the unified input JSON (unified_input_samples.json).
+    Each sample has: input_prompt (stripped), evidence, category, optional answer, optional time_gap.
+    Returns list of dicts.
+    """
+    return list(iter_unified_samples(data_file))
+
+
+def read_json(path):
+    """Load a JSON file; uses orjson when installed, else stdlib json."""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if not isinstance(data, list):
-        raise ValueError("Unified input JSON must be a list of samples.")
-    return data
+        return json.load(f)
+
+
+def write_json(path, obj) -> None:
+    """Write obj as indented UTF-8 JSON; uses orjson when installed, else stdlib json."""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
 
 
 def call_test(input_prompt: str, model: str, **kwargs) -> str:
@@ -71,78 +139,264 @@ def call_test(input_prompt: str, model: str, **kwargs) -> str:
     Placeholder backend: same I/O as call_llm/call_vllm. Does not call external LLM;
     returns a fake prediction from input_prompt for pipeline validation.
     If category is passed, CONV_START + task instruction are applied first.
+    A system kwarg (static instructions) is treated as part of the input.
     """
     category = kwargs.get("category", "")
     content = _build_model_input(input_prompt or "", category=category) if category else _prepend_conv_prefix(input_prompt or "")
+    content = (kwargs.get("system") or "") + content
     if not content.strip():
         return "(empty)"
     return content[:-100] if len(content) > 100 else content
 
 
+_ENV_EXPORT_RE = re.compile(r"^\s*export\s+(OPENAI_API_KEY|OPENAI_BASE_URL)\s*=(.*)$", re.MULTILINE)
+
+
+@lru_cache(maxsize=1)
 def _load_env_local_sh():
-    """Load OPENAI_BASE_URL/OPENAI_API_KEY from scripts/env.local.sh when not already set in env."""
+    """Load OPENAI_BASE_URL/OPENAI_API_KEY from scripts/env.local.sh when not already set in env (parsed once per process)."""
     env_local = Path(__file__).resolve().parent.parent / "scripts" / "env.local.sh"
     if not env_local.is_file():
         return
-    for line in open(env_local, "r", encoding="utf-8"):
-        line = line.strip()
-        if not line or line.startswith("#") or not line.startswith("export "):
-            continue
-        rest = line[7:].strip()  # after "export "
-        if "=" not in rest:
-            continue
-        key, _, val = rest.partition("=")
-        key = key.strip()
+    with open(env_local, "r", encoding="utf-8") as f:
+        text = f.read()
+    for key, val in _ENV_EXPORT_RE.findall(text):
         val = val.strip().strip('"').strip("'").strip()
-        if key in ("OPENAI_API_KEY", "OPENAI_BASE_URL") and val and not os.environ.get(key):
+        if val and not os.environ.get(key):
             os.environ[key] = val
 
 
-def _get_openai_client():
-    """Lazy init OpenAI client from OPENAI_API_KEY (and optional OPENAI_BASE_URL). env.local.sh is loaded if present."""
+def _openai_client_kwargs() -> dict:
+    """api_key / base_url for OpenAI clients from OPENAI_API_KEY (and optional OPENAI_BASE_URL). env.local.sh is loaded if present."""
     _load_env_local_sh()
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key or api_key.strip() == "":
         raise ValueError(
             "OPENAI_API_KEY is not set. Set it in env or in evaluation_framework/scripts/env.local.sh"
         )
-    from openai import OpenAI
     kwargs = {"api_key": api_key.strip()}
     base_url = os.environ.get("OPENAI_BASE_URL")
     if base_url and base_url.strip():
         kwargs["base_url"] = base_url.strip()
-    return OpenAI(**kwargs)
+    return kwargs
+
+
+def _openai_http_client(use_async: bool = False):
+    """Pooled httpx client for OpenAI clients; HTTP/2 (many requests multiplexed per connection) when h2 is installed."""
+    import httpx
+    from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    cls = DefaultAsyncHttpxClient if use_async else DefaultHttpxClient
+    return cls(http2=http2, limits=limits)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_openai_client():
+    """Lazy init a shared OpenAI client from OPENAI_API_KEY (and optional OPENAI_BASE_URL). env.local.sh is loaded if present."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(**_openai_client_kwargs(), http_client=_openai_http_client())
+    return _client
+
+
+# Persistent cache of call_llm responses (SQLite), keyed by model + messages + sampling params, so reruns
+# over unchanged inputs skip the API. Set LOCOMO_JUDGE_CACHE=0 to bypass; LOCOMO_JUDGE_CACHE_PATH overrides the file.
+_DEFAULT_LLM_CACHE_PATH = Path(__file__).resolve().parent.parent / ".judge_cache.sqlite3"
+_llm_cache_conn = None
+_llm_cache_lock = threading.Lock()
+
+
+def _llm_cache_enabled() -> bool:
+    return os.environ.get("LOCOMO_JUDGE_CACHE", "1").strip() != "0"
+
+
+def _llm_cache_key(model: str, messages: list, temperature: float, max_tokens: int) -> str:
+    payload = json.dumps([model, messages, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _get_llm_cache_conn():
+    """Lazy open the cache database (shared across threads; access is serialized by _llm_cache_lock)."""
+    global _llm_cache_conn
+    if _llm_cache_conn is None:
+        path = os.environ.get("LOCOMO_JUDGE_CACHE_PATH") or str(_DEFAULT_LLM_CACHE_PATH)
+        _llm_cache_conn = sqlite3.connect(path, check_same_thread=False)
+        _llm_cache_conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        _llm_cache_conn.commit()
+    return _llm_cache_conn
+
+
+def _llm_cache_get(key: str):
+    """Cached response text for key, or None."""
+    if not _llm_cache_enabled():
+        return None
+    with _llm_cache_lock:
+        row = _get_llm_cache_conn().execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _llm_cache_put(key: str, value: str) -> None:
+    if not _llm_cache_enabled():
+        return
+    with _llm_cache_lock:
+        conn = _get_llm_cache_conn()
+        conn.execute("INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, value))
+        conn.commit()
+
+
+def _chat_messages(input_prompt: str, category: str = "", system: str = None) -> list:
+    """Chat messages for one request: optional system message, then the user content
+    (CONV_START + task instruction when category is set, else CONV_START only)."""
+    content = _build_model_input(input_prompt or "", category=category) if category else _prepend_conv_prefix(input_prompt or "")
+    messages = [{"role": "user", "content": content}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    return messages
 
 
 def call_llm(input_prompt: str, model: str, **kwargs) -> str:
     """
     Call OpenAI-compatible API for prediction. Uses OPENAI_API_KEY and optional OPENAI_BASE_URL.
     kwargs: temperature, max_tokens, category. When category is set, CONV_START + task instruction are prepended.
+    system: optional static instructions sent as a leading system message; keeping them byte-identical
+    across calls lets OpenAI-compatible providers serve that prefix from their prompt cache.
+    Successful responses are memoized on disk (see _llm_cache_get); LOCOMO_JUDGE_CACHE=0 bypasses it.
     """
+    temperature = float(kwargs.get("temperature", 0.3))
+    max_tokens = int(kwargs.get("max_tokens", 2048))
+    messages = _chat_messages(input_prompt, kwargs.get("category", ""), kwargs.get("system"))
+    key = _llm_cache_key(model, messages, temperature, max_tokens)
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        return cached
     client = _get_openai_client()
-    temperature = kwargs.get("temperature", 0.3)
-    max_tokens = kwargs.get("max_tokens", 2048)
-    category = kwargs.get("category", "")
-    content = _build_model_input(input_prompt or "", category=category) if category else _prepend_conv_prefix(input_prompt or "")
     try:
         response = client.chat.completions.create(
             model=model,
-            messages=[{"role": "user", "content": content}],
-            temperature=float(temperature),
-            max_tokens=int(max_tokens),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
         )
         text = (response.choices[0].message.content or "").strip()
-        return text if text else "(empty)"
+        if not text:
+            return "(empty)"
+        _llm_cache_put(key, text)
+        return text
     except Exception as e:
         return f"[API Error: {e}]"
 
 
-def call_vllm(input_prompt: str, model: str, **kwargs) -> str:
+async def call_llm_async(input_prompt: str, model: str, sem, client, **kwargs) -> str:
     """
-    Call local vLLM (or similar) for prediction. Not implemented yet.
-    When implemented, use _build_model_input(input_prompt, category=kwargs.get("category")) before request.
+    Async call_llm on a shared AsyncOpenAI client; sem (asyncio.Semaphore) bounds requests in flight.
+    kwargs: same as call_llm.
     """
-    raise NotImplementedError("call_vllm not implemented yet; use --backend call_test for now.")
+    temperature = float(kwargs.get("temperature", 0.3))
+    max_tokens = int(kwargs.get("max_tokens", 2048))
+    messages = _chat_messages(input_prompt, kwargs.get("category", ""), kwargs.get("system"))
+    key = _llm_cache_key(model, messages, temperature, max_tokens)
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        return cached
+    async with sem:
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+            text = (response.choices[0].message.content or "").strip()
+            if not text:
+                return "(empty)"
+            _llm_cache_put(key, text)
+            return text
+        except Exception as e:
+            return f"[API Error: {e}]"
+
+
+def call_llm_many(input_prompts: list, model: str, concurrency: int = 32, desc: str = None, **kwargs) -> list:
+    """
+    Run call_llm for many prompts concurrently (asyncio, up to `concurrency` requests in flight);
+    returns one response per prompt, in order.
+    desc: if set (and tqdm is installed), show a progress bar advanced as each request finishes.
+    kwargs: categories / systems (optional per-prompt lists), plus call_llm's temperature, max_tokens.
+    """
+    n = len(input_prompts)
+    categories = kwargs.pop("categories", None) or [""] * n
+    systems = kwargs.pop("systems", None) or [None] * n
+
+    async def _run():
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(**_openai_client_kwargs(), http_client=_openai_http_client(use_async=True))
+        sem = asyncio.Semaphore(max(1, int(concurrency)))
+        pbar = tqdm(total=n, desc=desc) if desc and tqdm is not None else None
+
+        async def _one(p, c, s):
+            text = await call_llm_async(p, model, sem, client, category=c, system=s, **kwargs)
+            if pbar is not None:
+                pbar.update(1)
+            return text
+
+        try:
+            return await asyncio.gather(*[_one(p, c, s) for p, c, s in zip(input_prompts, categories, systems)])
+        finally:
+            if pbar is not None:
+                pbar.close()
+            await client.close()
+
+    return list(asyncio.run(_run())) if n else []
+
+
+# Offline vLLM engine, created on first call_vllm. vLLM batches internally, so callers share one
+# engine and calls are serialized by the lock.
+_vllm_engine = None
+_vllm_lock = threading.Lock()
+
+
+def _get_vllm_engine(model: str):
+    """Lazy init the vLLM engine for model (HF id or local path) with prefix caching enabled."""
+    global _vllm_engine
+    if _vllm_engine is None:
+        from vllm import LLM
+        _vllm_engine = LLM(model=model, max_num_seqs=256, enable_prefix_caching=True)
+    return _vllm_engine
+
+
+def call_vllm(input_prompts: list, model: str, **kwargs) -> list:
+    """
+    Call local vLLM for a batch of predictions in one generate pass; returns one prediction per prompt.
+    kwargs: categories / systems (one per prompt), temperature, max_tokens, system (same meaning as in call_llm).
+    Each prompt is built like call_llm (CONV_START + task instruction when its category is set).
+    """
+    from vllm import SamplingParams
+
+    n = len(input_prompts)
+    categories = kwargs.get("categories") or [""] * n
+    systems = kwargs.get("systems") or [kwargs.get("system")] * n
+    conversations = [_chat_messages(p, c, s) for p, c, s in zip(input_prompts, categories, systems)]
+    params = SamplingParams(
+        temperature=float(kwargs.get("temperature", 0.3)),
+        max_tokens=int(kwargs.get("max_tokens", 2048)),
+    )
+    with _vllm_lock:
+        engine = _get_vllm_engine(model)
+        try:
+            outputs = engine.chat(conversations, params, use_tqdm=False)
+        except Exception as e:
+            return [f"[vLLM Error: {e}]"] * len(conversations)
+    return [(o.outputs[0].text or "").strip() or "(empty)" for o in outputs]
 
 
 def call_model(
@@ -160,10 +414,55 @@ def call_model(
     if backend == "call_llm":
         return call_llm(input_prompt, model=model, **kwargs)
     if backend == "call_vllm":
-        return call_vllm(input_prompt, model=model, **kwargs)
+        category = kwargs.pop("category", "")
+        return call_vllm([input_prompt], model=model, categories=[category], **kwargs)[0]
     raise ValueError(f"Unknown backend: {backend}. Use call_test, call_llm, or call_vllm.")
 
 
+def call_model_batch(
+    input_prompts: list,
+    model: str,
+    backend: str = "call_test",
+    categories: list = None,
+    systems: list = None,
+    concurrency: int = 32,
+    desc: str = None,
+    **kwargs,
+) -> list:
+    """
+    Batch version of call_model: one prediction per prompt, in order.
+    call_vllm receives the whole batch in one request; call_llm runs up to `concurrency` requests
+    in flight (call_llm_many); call_test is called per prompt.
+    categories / systems: optional per-prompt lists (same role as call_model's category / system kwargs).
+    desc: progress bar label for call_llm (see call_llm_many).
+    Identical (prompt, category, system) requests are sent once and the response is shared.
+    """
+    n = len(input_prompts)
+    categories = list(categories) if categories is not None else [""] * n
+    systems = list(systems) if systems is not None else [None] * n
+    keys = list(zip(input_prompts, categories, systems))
+    unique = list(dict.fromkeys(keys))
+    if len(unique) < n:
+        responses = call_model_batch(
+            [k[0] for k in unique], model=model, backend=backend,
+            categories=[k[1] for k in unique], systems=[k[2] for k in unique],
+            concurrency=concurrency, desc=desc, **kwargs
+        )
+        by_key = dict(zip(unique, responses))
+        return [by_key[k] for k in keys]
+    if backend == "call_vllm":
+        return call_vllm(list(input_prompts), model=model, categories=categories, systems=systems, **kwargs)
+    if backend == "call_llm":
+        return call_llm_many(
+            list(input_prompts), model=model, concurrency=concurrency, desc=desc,
+            categories=categories, systems=systems, **kwargs
+        )
+    return [
+        call_model(p, model=model, backend=backend, category=c, system=s, **kwargs)
+        for p, c, s in zip(input_prompts, categories, systems)
+    ]
+
+
 def extract_question_from_input_prompt(input_prompt: str) -> str:
     """
     Extract question from input_prompt. Locomo format: "...\\n\\nQuestion: <question>" -> text after "Question:".
@@ -1,25 +1,37 @@
+import asyncio
 import json
 import os
-import time
-from tqdm import tqdm
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Use env OPENAI_BASE_URL, OPENAI_API_KEY (optional: OPENAI_BASE_URL for custom endpoint)
-_client = None
-
-
-def get_client():
-    global _client
-    if _client is None:
-        api_key = os.environ.get("OPENAI_API_KEY", "").strip()
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY is not set. Set it in your environment or env.local.sh.")
-        kwargs = {"api_key": api_key}
-        base_url = os.environ.get("OPENAI_BASE_URL", "").strip()
-        if base_url:
-            kwargs["base_url"] = base_url
-        _client = OpenAI(**kwargs)
-    return _client
+
+
+def _client_kwargs():
+    api_key = os.environ.get("OPENAI_API_KEY", "").strip()
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY is not set. Set it in your environment or env.local.sh.")
+    kwargs = {"api_key": api_key}
+    base_url = os.environ.get("OPENAI_BASE_URL", "").strip()
+    if base_url:
+        kwargs["base_url"] = base_url
+    return kwargs
+
+
+def _http_client():
+    # Pooled connections; HTTP/2 multiplexing when the h2 package is installed.
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    return DefaultAsyncHttpxClient(http2=http2, limits=limits)
 
 model_list = ["gpt-4o-mini", "gpt-4o", "gemini-2.5-flash", "gpt-5-nano"]
 
@@ -81,8 +93,8 @@ def safe_json_parse(resp: str):
         if resp.startswith("'") or resp.startswith('"'):
             resp = resp.strip("'").strip('"')
         try:
-            return json.loads(resp)
-        except json.JSONDecodeError:
+            return orjson.loads(resp) if orjson is not None else json.loads(resp)
+        except ValueError:
             decoded = json.loads(resp.encode().decode('unicode_escape'))
             if isinstance(decoded, str):
                 return json.loads(decoded)
@@ -91,73 +103,92 @@ def safe_json_parse(resp: str):
         print(f"safe_json_parse error: {e}")
         return []
 
-def call_openai(prompt: str, model="gpt-4o-mini", temperature=1.0):
+def json_line(obj) -> str:
+    # One JSON Lines record (UTF-8, no ASCII escaping); orjson when installed.
+    if orjson is not None:
+        return orjson.dumps(obj).decode() + "\n"
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+async def call_openai_async(prompt: str, model, temperature, sem, client):
+    async with sem:
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+            )
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"API call failed: {e}")
+            return ""
+
+def call_openai_many(prompts, model="gpt-4o-mini", temperature=1.0, concurrency=8, on_response=None):
+    # One chat.completions request per prompt, with up to `concurrency` in flight; results in prompt order.
+    # model may be a single name or a list aligned with prompts (to mix models in one batch).
+    # on_response(index, response), if given, runs as soon as each response arrives.
+    models = [model] * len(prompts) if isinstance(model, str) else list(model)
     try:
-        client = get_client()
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temperature,
-        )
-        return response.choices[0].message.content.strip()
+        client_kwargs = _client_kwargs()
     except Exception as e:
         print(f"API call failed: {e}")
-        return ""
+        return [""] * len(prompts)
+
+    async def _run():
+        client = AsyncOpenAI(**client_kwargs, http_client=_http_client())
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _one(i, prompt, m):
+            resp = await call_openai_async(prompt, m, temperature, sem, client)
+            if on_response is not None:
+                on_response(i, resp)
+            return resp
 
-if __name__ == "__main__":
-    output_file = "cue_dialogue_data.json"
-    
-    existing_data = []
-    if os.path.exists(output_file):
         try:
-            with open(output_file, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-            print(f"Found {len(existing_data)} existing data entries, will append new data")
-        except Exception as e:
-            print(f"Error reading existing file: {e}")
-            existing_data = []
-    
-    all_new_data = []
-    
+            return await asyncio.gather(*[_one(i, p, m) for i, (p, m) in enumerate(zip(prompts, models))])
+        finally:
+            await client.close()
+
+    return asyncio.run(_run())
+
+if __name__ == "__main__":
+    # JSON Lines, append-only: one cue per line, written as each response is parsed (earlier runs are kept as-is).
+    output_file = "cue_dialogue_data.jsonl"
+
+    relation_types = ["causal", "state", "goal", "value"]
+
+    # One concurrent batch over every (model, relation) pair; the semaphore in call_openai_many bounds in-flight requests.
+    tasks = [(model, relation) for model in model_list for relation in relation_types]
+    print(f"\n=== Generating cue_dialogues for {len(model_list)} models x relation_types: {', '.join(relation_types)} ===")
+
+    new_counts = dict.fromkeys(model_list, 0)
+    with open(output_file, "a", encoding="utf-8") as f:
+        # Each response's cues are appended and flushed as soon as it arrives, so an interrupted run
+        # keeps everything received so far.
+        def _write_response(i, resp):
+            model, relation = tasks[i]
+            if not resp:
+                return
+
+            js = safe_json_parse(resp)
+            if not js:
+                return
+
+            for j in js:
+                j["relation_type"] = relation
+                j["model_name"] = model
+                f.write(json_line(j))
+            f.flush()
+            new_counts[model] += len(js)
+
+        call_openai_many(
+            [CUE_DIALOGUE_PROMPT.format(relation_type=relation, num_samples=13) for _, relation in tasks],
+            model=[model for model, _ in tasks],
+            temperature=0.9,
+            on_response=_write_response,
+        )
+
     for model in model_list:
-        print(f"\n\n==============================")
-        print(f"Generating cue_dialogue with model: {model}")
-        print(f"==============================")
-        
-        new_data = []
-        relation_types = ["causal", "state", "goal", "value"]
-        
-        for relation in relation_types:
-            print(f"\n=== {model} | Generating cue_dialogues for relation_type: {relation} ===")
-            prompt = CUE_DIALOGUE_PROMPT.format(
-                relation_type=relation,
-                num_samples=13
-            )
+        print(f" {model} generation complete: {new_counts[model]} new entries")
 
-            for i in tqdm(range(1)):
-                resp = call_openai(prompt, model=model, temperature=0.9)
-                if not resp:
-                    continue
-                    
-                js = safe_json_parse(resp)
-                if not js:
-                    continue
-                    
-                for j in js:
-                    j["relation_type"] = relation
-                    j["model_name"] = model
-                    new_data.append(j)
-                    
-                time.sleep(0.5)
-        
-        all_new_data.extend(new_data)
-        print(f" {model} generation complete: {len(new_data)} new entries")
-
-    all_data = existing_data + all_new_data
-    
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
-    
-    print(f"\n\n All data saved to unified file → {output_file}")
-    print(f" Total data entries: {len(all_data)}")
-    print(f" New entries this run: {len(all_new_data)}")
\ No newline at end of file
+    print(f"\n\n New data appended to → {output_file}")
+    print(f" New entries this run: {sum(new_counts.values())}")
@@ -1,20 +1,37 @@
 import json
 import os
 import numpy as np
+import torch
 from pathlib import Path
-from tqdm import tqdm
-from rank_bm25 import BM25Okapi
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def load_all_data():
-    # RANK_INPUT: path to complete cue-query JSON (default: complete_data_all_models.json in script dir)
+    # RANK_INPUT: path to complete cue-query JSON (default: complete_data_all_models.json in script dir).
+    # A .jsonl path is read as JSON Lines (one entry per line).
     default_path = Path(__file__).resolve().parent / "complete_data_all_models.json"
     input_file = os.environ.get("RANK_INPUT", str(default_path))
 
+    # trigger_query.py appends to the .jsonl log and rewrites the .json at the end of a run, so a
+    # newer log means an interrupted run whose records the .json is missing.
+    log_file = Path(input_file).with_suffix(".jsonl")
+    if input_file.endswith(".json") and log_file.exists() and os.path.exists(input_file) \
+            and log_file.stat().st_mtime > os.path.getmtime(input_file):
+        print(f"Warning: {log_file} is newer than {input_file}; "
+              f"run `python trigger_query.py --compact` or set RANK_INPUT={log_file}")
+
+    loads = orjson.loads if orjson is not None else json.loads
     try:
-        with open(input_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(input_file, "rb") as f:
+            if input_file.endswith(".jsonl"):
+                data = [loads(line) for line in f if line.strip()]
+            else:
+                data = loads(f.read())
             print(f"Data loaded: {len(data)} entries")
             return data
     except FileNotFoundError:
@@ -24,54 +41,91 @@ def load_all_data():
         print(f"Error loading {input_file}: {e}")
         return []
 
+def bm25_pair_scores(doc_tokens, query_tokens, k1=1.5, b=0.75, epsilon=0.25):
+    # BM25Okapi (rank_bm25 defaults, incl. its epsilon floor for negative idf) score of
+    # query_tokens[i] against document i only, for every i, as NumPy vector ops over
+    # (doc, term) codes: no per-document Python dicts and no full-corpus scoring.
+    n = len(doc_tokens)
+    vocab = {}
+    doc_ids = [vocab.setdefault(t, len(vocab)) for doc in doc_tokens for t in doc]
+    if not vocab:
+        return np.zeros(n, dtype=np.float64)
+    v = len(vocab)
+    doc_len = np.array([len(doc) for doc in doc_tokens], dtype=np.float64)
+    doc_idx = np.repeat(np.arange(n, dtype=np.int64), doc_len.astype(np.int64))
+    codes, tf_counts = np.unique(doc_idx * v + np.array(doc_ids, dtype=np.int64), return_counts=True)
+
+    df = np.bincount(codes % v, minlength=v).astype(np.float64)
+    idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+    idf[idf < 0] = epsilon * idf.mean()
+    norm = k1 * (1 - b + b * doc_len / doc_len.mean())
+
+    q_pairs, q_ids = [], []
+    for i, tokens in enumerate(query_tokens):
+        for t in tokens:
+            tid = vocab.get(t)
+            if tid is not None:
+                q_pairs.append(i)
+                q_ids.append(tid)
+    q_pairs = np.array(q_pairs, dtype=np.int64)
+    q_ids = np.array(q_ids, dtype=np.int64)
+    q_codes = q_pairs * v + q_ids
+    pos = np.minimum(np.searchsorted(codes, q_codes), len(codes) - 1)
+    tf = np.where(codes[pos] == q_codes, tf_counts[pos], 0).astype(np.float64)
+    term_scores = idf[q_ids] * (tf * (k1 + 1) / (tf + norm[q_pairs]))
+    return np.bincount(q_pairs, weights=term_scores, minlength=n)
+
 def calculate_similarity_scores(data):
     print("Loading similarity models...")
     
     bm25_corpus = [d["cue_dialogue"] for d in data]
     bm25_tokens = [doc.lower().split() for doc in bm25_corpus]
-    bm25 = BM25Okapi(bm25_tokens)
     
     # Optional: set SENTENCE_TRANSFORMER_MPNET and SENTENCE_TRANSFORMER_BGE to local paths
     mpnet_path = os.environ.get("SENTENCE_TRANSFORMER_MPNET", "sentence-transformers/multi-qa-mpnet-base-dot-v1")
     bge_path = os.environ.get("SENTENCE_TRANSFORMER_BGE", "BAAI/bge-small-en-v1.5")
-    mpnet = SentenceTransformer(mpnet_path)
-    bge = SentenceTransformer(bge_path)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    mpnet = SentenceTransformer(mpnet_path, device=device)
+    bge = SentenceTransformer(bge_path, device=device)
+    if device == "cuda":
+        # fp16 halves encoder memory traffic on GPU; scores below are still accumulated in fp32.
+        mpnet.half()
+        bge.half()
     
     print("Encoding embeddings...")
     
     cue_texts = [d["cue_dialogue"] for d in data]
     query_texts = [d["trigger_query"] for d in data]
+    query_tokens = [q.lower().split() for q in query_texts]
     
-    cue_emb_mpnet = mpnet.encode(cue_texts, batch_size=64, convert_to_tensor=True, show_progress_bar=True)
-    query_emb_mpnet = mpnet.encode(query_texts, batch_size=64, convert_to_tensor=True, show_progress_bar=True)
-    
-    cue_emb_bge = bge.encode(cue_texts, batch_size=64, convert_to_tensor=True, show_progress_bar=True)
-    query_emb_bge = bge.encode(query_texts, batch_size=64, convert_to_tensor=True, show_progress_bar=True)
-    
-    print("Calculating similarity scores...")
-    results = []
+    # One encode pass per model over cues + queries; normalized so cosine similarity is a dot product.
+    n = len(cue_texts)
+    all_texts = cue_texts + query_texts
     
-    all_mpnet_scores = []
-    all_bge_scores = []
-    all_bm25_scores = []
-    all_combined_scores = []
-    
-    for i, d in enumerate(tqdm(data)):
-        cue = d["cue_dialogue"]
-        query = d["trigger_query"]
-        
-        bm25_score = bm25.get_scores(query.lower().split())[i]
-        
-        mpnet_score = float(util.cos_sim(cue_emb_mpnet[i], query_emb_mpnet[i]))
-        bge_score = float(util.cos_sim(cue_emb_bge[i], query_emb_bge[i]))
-        
-        combined = np.mean([mpnet_score, bge_score]) * 0.8 + (bm25_score / (bm25_score + 1)) * 0.2
+    # inference_mode: no autograd bookkeeping; embeddings and the score reductions stay on `device`
+    # and only the final per-pair scores are copied back to the CPU.
+    with torch.inference_mode():
+        emb_mpnet = mpnet.encode(all_texts, batch_size=128, convert_to_tensor=True, normalize_embeddings=True, show_progress_bar=True)
+        cue_emb_mpnet, query_emb_mpnet = emb_mpnet[:n], emb_mpnet[n:]
         
-        all_mpnet_scores.append(mpnet_score)
-        all_bge_scores.append(bge_score)
-        all_bm25_scores.append(bm25_score)
-        all_combined_scores.append(combined)
+        emb_bge = bge.encode(all_texts, batch_size=128, convert_to_tensor=True, normalize_embeddings=True, show_progress_bar=True)
+        cue_emb_bge, query_emb_bge = emb_bge[:n], emb_bge[n:]
         
+        print("Calculating similarity scores...")
+        # Row-wise dot products of the normalized embeddings = per-pair cosine similarity, in one op.
+        all_mpnet_scores = (cue_emb_mpnet.float() * query_emb_mpnet.float()).sum(dim=1).cpu().numpy().astype(np.float64)
+        all_bge_scores = (cue_emb_bge.float() * query_emb_bge.float()).sum(dim=1).cpu().numpy().astype(np.float64)
+    all_bm25_scores = bm25_pair_scores(bm25_tokens, query_tokens)
+    all_combined_scores = (all_mpnet_scores + all_bge_scores) / 2 * 0.8 + (all_bm25_scores / (all_bm25_scores + 1)) * 0.2
+    
+    results = []
+    for d, mpnet_score, bge_score, bm25_score, combined in zip(
+        data,
+        all_mpnet_scores.tolist(),
+        all_bge_scores.tolist(),
+        all_bm25_scores.tolist(),
+        all_combined_scores.tolist(),
+    ):
         result_item = d.copy()
         result_item.update({
             "scores": {
@@ -102,11 +156,17 @@ def calculate_similarity_scores(data):
 
 def calculate_ranks(scores):
     sorted_indices = np.argsort(scores)
-    ranks = np.zeros(len(scores), dtype=int)
-    for rank, idx in enumerate(sorted_indices, 1):
-        ranks[idx] = rank
+    ranks = np.empty(len(sorted_indices), dtype=int)
+    ranks[sorted_indices] = np.arange(1, len(sorted_indices) + 1)
     return ranks.tolist()
 
+def group_stats(keys, scores):
+    # (key, count, mean score) per distinct key, in one grouped pass (np.unique + bincount).
+    groups, inverse = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(groups))
+    sums = np.bincount(inverse, weights=scores, minlength=len(groups))
+    return [(g, int(c), s / c) for g, c, s in zip(groups.tolist(), counts.tolist(), sums.tolist())]
+
 if __name__ == "__main__":
     print("Loading data...")
     all_data = load_all_data()
@@ -120,11 +180,17 @@ if __name__ == "__main__":
     scored_data = calculate_similarity_scores(all_data)
     
     print("\nSorting by combined similarity (low similarity first)...")
-    sorted_by_combined = sorted(scored_data, key=lambda x: x["final_similarity_score"])
+    final_scores = np.array([item["final_similarity_score"] for item in scored_data], dtype=np.float64)
+    order = np.argsort(final_scores, kind="stable")
+    sorted_by_combined = [scored_data[i] for i in order.tolist()]
     
     output_file = "evaluated_similarity_results.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(sorted_by_combined, f, ensure_ascii=False, indent=2)
+    if orjson is not None:
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(sorted_by_combined, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(sorted_by_combined, f, ensure_ascii=False, indent=2)
     
     print(f"Results saved: {output_file}")
     
@@ -141,20 +207,16 @@ if __name__ == "__main__":
         print("-" * 100)
     
     print("\nStatistics:")
-    combined_scores = [item["final_similarity_score"] for item in sorted_by_combined]
-    print(f"Combined similarity range: {min(combined_scores):.4f} - {max(combined_scores):.4f}")
-    print(f"Average combined similarity: {np.mean(combined_scores):.4f}")
+    combined_scores = final_scores[order]
+    print(f"Combined similarity range: {combined_scores.min():.4f} - {combined_scores.max():.4f}")
+    print(f"Average combined similarity: {combined_scores.mean():.4f}")
     print(f"Median combined similarity: {np.median(combined_scores):.4f}")
-    print(f"Standard deviation: {np.std(combined_scores):.4f}")
+    print(f"Standard deviation: {combined_scores.std():.4f}")
     
     print("\nStatistics by model:")
-    models = set(item['model_name'] for item in sorted_by_combined)
-    for model in models:
-        model_scores = [item["final_similarity_score"] for item in sorted_by_combined if item['model_name'] == model]
-        print(f"{model}: {len(model_scores)} entries, average similarity: {np.mean(model_scores):.4f}")
+    for model, count, mean in group_stats([item["model_name"] for item in sorted_by_combined], combined_scores):
+        print(f"{model}: {count} entries, average similarity: {mean:.4f}")
     
     print("\nStatistics by relation type:")
-    relation_types = set(item['relation_type'] for item in sorted_by_combined)
-    for rel_type in relation_types:
-        rel_scores = [item["final_similarity_score"] for item in sorted_by_combined if item['relation_type'] == rel_type]
-        print(f"{rel_type}: {len(rel_scores)} entries, average similarity: {np.mean(rel_scores):.4f}")
\ No newline at end of file
+    for rel_type, count, mean in group_stats([item["relation_type"] for item in sorted_by_combined], combined_scores):
+        print(f"{rel_type}: {count} entries, average similarity: {mean:.4f}")
\ No newline at end of file
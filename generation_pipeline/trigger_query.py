@@ -1,30 +1,119 @@
+import argparse
+import asyncio
+import atexit
+import hashlib
 import json
+import logging
 import os
+import queue
+import random
+import re
+import sqlite3
 import time
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+import httpx
 from tqdm import tqdm
-from openai import OpenAI
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
 
-# Use env OPENAI_BASE_URL, OPENAI_API_KEY
-_client = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def get_client():
-    global _client
-    if _client is None:
-        api_key = os.environ.get("OPENAI_API_KEY", "").strip()
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY is not set. Set it in your environment or env.local.sh.")
-        kwargs = {"api_key": api_key}
-        base_url = os.environ.get("OPENAI_BASE_URL", "").strip()
-        if base_url:
-            kwargs["base_url"] = base_url
-        _client = OpenAI(**kwargs)
-    return _client
+log = logging.getLogger("trigger_query")
+
+# Use env OPENAI_BASE_URL, OPENAI_API_KEY; optional GEMINI_BASE_URL (+ GEMINI_API_KEY) for gemini-* models
+
+# Max trigger-query requests in flight at once, per model
+CONCURRENCY = 20
+
+# Requests per minute allowed per model (token bucket in call_openai_many); set these to your account's limits.
+MODEL_RPM = {"gpt-4o-mini": 5000, "gpt-4o": 5000, "gemini-2.5-flash": 1000, "gpt-5-nano": 5000}
+DEFAULT_RPM = 500
+
+# Transient failures (429, connection errors/timeouts, 5xx) are retried up to MAX_RETRIES times, waiting a
+# random 0..min(RETRY_MAX_WAIT, RETRY_BASE_WAIT * 2**attempt) seconds (at least Retry-After for a 429)
+MAX_RETRIES = 5
+RETRY_BASE_WAIT = 1.0
+RETRY_MAX_WAIT = 30.0
+
+# --batch: seconds between Batch API status polls; a job is given up on (and kept for a later
+# resume) after this many status checks in a row fail
+BATCH_POLL_SECONDS = 30
+BATCH_MAX_POLL_FAILURES = 10
+_BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# --batch: submitted jobs that have not been collected yet ({batch_id: {"model", "custom_ids"}}). A run
+# that is interrupted while polling resumes those jobs instead of submitting (and paying for) new ones.
+# TRIGGER_QUERY_BATCH_STATE overrides the file location.
+_DEFAULT_BATCH_STATE_PATH = Path(__file__).resolve().parent / ".trigger_query_batches.json"
+
+
+def _client_kwargs(model=None):
+    api_key = os.environ.get("OPENAI_API_KEY", "").strip()
+    base_url = os.environ.get("OPENAI_BASE_URL", "").strip()
+    # gemini-* models go to GEMINI_BASE_URL (e.g. Google's OpenAI-compatible endpoint) when it is set.
+    gemini_base_url = os.environ.get("GEMINI_BASE_URL", "").strip()
+    if model and model.startswith("gemini") and gemini_base_url:
+        base_url = gemini_base_url
+        api_key = os.environ.get("GEMINI_API_KEY", "").strip() or api_key
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY is not set. Set it in your environment or env.local.sh.")
+    kwargs = {"api_key": api_key}
+    if base_url:
+        kwargs["base_url"] = base_url
+    return kwargs
+
+
+def _http_client(use_async=False):
+    # Pooled connections sized for CONCURRENCY; HTTP/2 multiplexing when the h2 package is installed.
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    cls = DefaultAsyncHttpxClient if use_async else DefaultHttpxClient
+    return cls(http2=http2, limits=limits)
+
+
+@lru_cache(maxsize=8)
+def _endpoint_client(api_key, base_url):
+    # One client (and connection pool) per endpoint, shared by every model routed to it (--batch file
+    # and job calls). SDK retries are off, as for the async clients in call_openai_many.
+    return OpenAI(api_key=api_key, base_url=base_url or None, max_retries=0, http_client=_http_client())
+
+
+def _endpoint(model=None):
+    # (api_key, base_url) that requests for `model` are sent with
+    kwargs = _client_kwargs(model)
+    return kwargs["api_key"], kwargs.get("base_url", "")
+
+
+def get_client(model=None):
+    return _endpoint_client(*_endpoint(model))
 
 model_list = ["gpt-4o-mini", "gpt-4o", "gemini-2.5-flash", "gpt-5-nano"]
 
-TRIGGER_QUERY_PROMPT = """
+# Static instructions, examples and output format, sent as the system message. Keeping everything
+# cue-specific out of it gives every request the same long prefix, which providers serve from their
+# prompt cache; the cue itself goes in the short user message (trigger_query_input).
+TRIGGER_QUERY_SYSTEM = """
 You are generating trigger queries that have implicit cognitive connections to given dialogues and create meaningful cognitive conflicts or contrasts with given dialogues, ensuring diverse perspectives in memory recall.
 
 CRITICAL REQUIREMENT: Each of the five trigger queries must represent a DISTINCT COGNITIVE ANGLE of conflict or recall.  They should not feel similar or repetitive.  Aim for five truly different ways that the trigger could relate to the cue.
@@ -59,7 +148,7 @@ Requirements:
 - Vary time gaps appropriately (one week to several months)
 - Do NOT include explanations or markdown
 - Include time_gap description for each (e.g., "one week later", "several months later", "a year after")
-- Output a valid JSON array ONLY
+- Output a valid JSON object ONLY
 
 EXAMPLES OF GOOD TRIGGER QUERIES:
 
@@ -84,29 +173,78 @@ Example 4 :
 - Trigger: "A: This tattoo represents everything I've been through this year."
 - Time Gap: "a year later"
 
-Cue Dialogue:
-{cue_dialogue}
-
-Relation Type: {relation_type}
+The cue dialogue and its relation type are given in the user message.
 
 Output strictly in this format:
-[
-  {{
-    "relation_type": "{relation_type}",
-    "cue_dialogue": "{cue_dialogue}",
-    "trigger_query": "A: ...",
-    "time_gap": "description of time interval"
-  }},
-  {{
-    "relation_type": "{relation_type}",
-    "cue_dialogue": "{cue_dialogue}",
-    "trigger_query": "A: ...",
-    "time_gap": "description of time interval"
-  }},
-  ... (exactly five items, each with a distinct cognitive angle)
-]
+{
+  "items": [
+    {
+      "trigger_query": "A: ...",
+      "time_gap": "description of time interval"
+    },
+    {
+      "trigger_query": "A: ...",
+      "time_gap": "description of time interval"
+    },
+    ... (exactly five items, each with a distinct cognitive angle)
+  ]
+}
 """
 
+# Structured output: the API returns exactly this shape, so responses parse with a plain json.loads.
+TRIGGER_QUERY_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "trigger_queries",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "items": {
+                    "type": "array",
+                    "minItems": 5,
+                    "maxItems": 5,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "trigger_query": {"type": "string"},
+                            "time_gap": {"type": "string"},
+                        },
+                        "required": ["trigger_query", "time_gap"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["items"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def response_format_for(model):
+    # Gemini's OpenAI-compatible endpoint may reject strict json_schema; plain JSON mode still avoids prose/markdown.
+    if model.startswith("gemini"):
+        return {"type": "json_object"}
+    return TRIGGER_QUERY_RESPONSE_FORMAT
+
+def trigger_query_input(cue_dialogue, relation_type):
+    # Per-cue user message (the only part of the request that varies between cues).
+    return f"Cue Dialogue:\n{cue_dialogue}\n\nRelation Type: {relation_type}"
+
+def _messages(prompt):
+    return [
+        {"role": "system", "content": TRIGGER_QUERY_SYSTEM},
+        {"role": "user", "content": prompt},
+    ]
+
+# Where a JSON array/object may begin inside a reply wrapped in prose or a markdown fence
+_JSON_START_RE = re.compile(r"[\[{]")
+_JSON_DECODER = json.JSONDecoder()
+
+def _looks_like_result(value):
+    # The {"items": [...]} object, or a bare array of item objects (not e.g. a stray "[5]" in prose)
+    return isinstance(value, dict) or (isinstance(value, list) and all(isinstance(x, dict) for x in value))
+
 def safe_json_parse(resp: str):
     if not resp or not isinstance(resp, str):
         return []
@@ -116,17 +254,18 @@ def safe_json_parse(resp: str):
     try:
         return json.loads(resp)
     except json.JSONDecodeError as e:
-        print(f"First parse failed: {e}")
+        log.debug(f"First parse failed: {e}")
     
-    try:
-        start_idx = resp.find('[')
-        end_idx = resp.rfind(']') + 1
-        
-        if start_idx != -1 and end_idx != 0:
-            json_str = resp[start_idx:end_idx]
-            return json.loads(json_str)
-    except Exception as e:
-        print(f"JSON extraction failed: {e}")
+    # Decode the first complete JSON value that starts at a bracket; unlike slicing from the first "["
+    # to the last "]", brackets inside strings or in trailing text don't break it.
+    for m in _JSON_START_RE.finditer(resp):
+        try:
+            value = _JSON_DECODER.raw_decode(resp, m.start())[0]
+        except ValueError:
+            continue
+        if _looks_like_result(value):
+            return value
+    log.debug("JSON extraction failed: no JSON array or object found")
     
     try:
         if resp.startswith("'") or resp.startswith('"'):
@@ -136,144 +275,594 @@ def safe_json_parse(resp: str):
             return json.loads(decoded)
         return decoded
     except Exception as e:
-        print(f"safe_json_parse failed: {e}")
-        print(f"Original response: {resp}")
+        log.warning(f"safe_json_parse failed: {e}")
+        log.warning(f"Original response: {resp}")
         return []
 
-def call_openai(prompt: str, model="gpt-4o-mini", temperature=1.0):
+def _retry_after(error, default=0.0):
+    # Seconds to wait from a 429's Retry-After header (default if absent or not a number).
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
     try:
-        client = get_client()
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temperature,
-        )
-        return response.choices[0].message.content.strip()
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+def _retry_wait(error, attempt):
+    # Seconds to wait before retrying after `error`, or None if it is not transient (auth, bad request, ...)
+    # or the retries are used up. Exponential backoff with full jitter; a 429 waits at least its Retry-After.
+    if attempt >= MAX_RETRIES or not isinstance(error, (RateLimitError, APIConnectionError, InternalServerError)):
+        return None
+    wait = random.uniform(0, min(RETRY_MAX_WAIT, RETRY_BASE_WAIT * 2 ** attempt))
+    if isinstance(error, RateLimitError):
+        wait = max(wait, _retry_after(error))
+    return wait
+
+class RateLimiter:
+    # Async token bucket: refills at rpm / 60 requests per second, bursts up to one second's worth.
+    # pause() holds every request for the model, e.g. for the Retry-After of a 429.
+    def __init__(self, rpm):
+        self.rate = rpm / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+async def call_openai_async(prompt: str, model, temperature, sem, client, limiter=None):
+    async with sem:
+        for attempt in range(MAX_RETRIES + 1):
+            if limiter is not None:
+                await limiter.acquire()
+            try:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=_messages(prompt),
+                    temperature=temperature,
+                    response_format=response_format_for(model),
+                )
+                return response.choices[0].message.content.strip()
+            except Exception as e:
+                wait = _retry_wait(e, attempt)
+                if wait is None:
+                    log.warning(f" API call failed: {e}")
+                    return ""
+                if isinstance(e, RateLimitError) and limiter is not None:
+                    # Hold every request for this model, not just this one.
+                    limiter.pause(wait)
+                else:
+                    await asyncio.sleep(wait)
+
+def call_openai_many(prompts, models, temperature=1.0, concurrency=CONCURRENCY, desc=None, on_response=None):
+    # One chat.completions request per (prompt, model) pair; responses come back in prompt order. Each model runs
+    # as its own worker pool (up to `concurrency` requests in flight, token bucket from MODEL_RPM) on
+    # the client for its endpoint, and all pools run at the same time. Progress is shown as requests
+    # complete, and on_response(index, response), if given, runs as soon as each response arrives.
+    model_indices = {}
+    for i, model in enumerate(models):
+        model_indices.setdefault(model, []).append(i)
+    try:
+        endpoints = {model: _endpoint(model) for model in model_indices}
     except Exception as e:
-        print(f" API call failed: {e}")
+        log.warning(f" API call failed: {e}")
+        return [""] * len(prompts)
+
+    responses = [""] * len(prompts)
+
+    async def _run_model(model, indices, client, pbar):
+        sem = asyncio.Semaphore(concurrency)
+        limiter = RateLimiter(MODEL_RPM.get(model, DEFAULT_RPM))
+
+        async def _one(i):
+            resp = await call_openai_async(prompts[i], model, temperature, sem, client, limiter)
+            responses[i] = resp
+            if on_response is not None:
+                on_response(i, resp)
+            pbar.update(1)
+
+        await asyncio.gather(*[_one(i) for i in indices])
+
+    async def _run():
+        # Models routed to the same endpoint share one client and its connection pool. SDK retries are
+        # off so every retry goes through call_openai_async's backoff and the model's RateLimiter.
+        clients = {
+            (api_key, base_url): AsyncOpenAI(
+                api_key=api_key, base_url=base_url or None, max_retries=0, http_client=_http_client(use_async=True)
+            )
+            for api_key, base_url in set(endpoints.values())
+        }
+        try:
+            with tqdm(total=len(prompts), desc=desc) as pbar:
+                await asyncio.gather(*[
+                    _run_model(model, indices, clients[endpoints[model]], pbar)
+                    for model, indices in model_indices.items()
+                ])
+        finally:
+            for client in clients.values():
+                await client.close()
+
+    asyncio.run(_run())
+    return responses
+
+# Exact-match response cache (SQLite) keyed by sha256 of (model, temperature, messages): reruns reuse
+# a stored answer for an identical request instead of calling the API again.
+# TRIGGER_QUERY_CACHE=0 disables it; TRIGGER_QUERY_CACHE_PATH overrides the file location.
+_DEFAULT_CACHE_PATH = Path(__file__).resolve().parent / ".trigger_query_cache.sqlite3"
+_cache_conn = None
+
+
+def _cache_enabled():
+    return os.environ.get("TRIGGER_QUERY_CACHE", "1").strip() != "0"
+
+
+def _get_cache_conn():
+    global _cache_conn
+    if _cache_conn is None:
+        path = os.environ.get("TRIGGER_QUERY_CACHE_PATH") or str(_DEFAULT_CACHE_PATH)
+        _cache_conn = sqlite3.connect(path)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        _cache_conn.commit()
+    return _cache_conn
+
+
+# The static system prompt is hashed once; each key only hashes the per-cue part on a copy of this state.
+_CACHE_KEY_BASE = hashlib.sha256(TRIGGER_QUERY_SYSTEM.encode("utf-8"))
+
+def cache_key(model, prompt, temperature):
+    h = _CACHE_KEY_BASE.copy()
+    h.update(json.dumps([model, temperature, prompt], ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_get(key):
+    if not _cache_enabled():
+        return None
+    row = _get_cache_conn().execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def cache_put(key, value):
+    if not _cache_enabled():
+        return
+    conn = _get_cache_conn()
+    conn.execute("INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)", (key, value))
+    conn.commit()
+
+def _batch_request_line(custom_id, prompt, model, temperature):
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": _messages(prompt),
+            "temperature": temperature,
+            "response_format": response_format_for(model),
+        },
+    }, ensure_ascii=False)
+
+def _batch_output_text(row):
+    # Message text from one Batch API output line, or "" when that request failed.
+    response = row.get("response") or {}
+    if response.get("status_code") != 200:
         return ""
+    try:
+        return (response["body"]["choices"][0]["message"]["content"] or "").strip()
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+def _batch_state_path():
+    return Path(os.environ.get("TRIGGER_QUERY_BATCH_STATE") or _DEFAULT_BATCH_STATE_PATH)
+
+def load_batch_state():
+    path = _batch_state_path()
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except Exception as e:
+        log.warning(f" Failed to read batch state {path}: {e}")
+        return {}
+    # Entries from the older {model: batch_id} layout don't say which requests they cover; resume
+    # them as covering none, so their requests are resubmitted rather than lost.
+    return {
+        (job if isinstance(job, str) else key): (job if isinstance(job, dict) else {"model": key, "custom_ids": []})
+        for key, job in state.items()
+    }
+
+def save_batch_state(state):
+    path = _batch_state_path()
+    if not state:
+        path.unlink(missing_ok=True)
+        return
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+def call_openai_batch(prompts, models, temperature=1.0, on_response=None):
+    # Same result as call_openai_many, but submitted through the OpenAI Batch API: one job per model
+    # (plus any resumed jobs), polled until every job finishes. Batch requests are billed at a discount and use a separate
+    # rate-limit pool, but can take up to the 24h completion window. Requests that fail or are missing
+    # from a job's output come back as "". on_response(index, response), if given, runs for each
+    # output line as soon as its job finishes.
+    # custom_id is the request's cache key, so a job resumed from the batch state file (saved as soon as
+    # it is submitted) maps back onto this run's prompts even if their order changed.
+    indices_by_model = {}
+    indices_by_id = {}
+    custom_ids = []
+    for i, (prompt, model) in enumerate(zip(prompts, models)):
+        custom_id = cache_key(model, prompt, temperature)
+        custom_ids.append(custom_id)
+        if custom_id not in indices_by_id:
+            indices_by_model.setdefault(model, []).append(i)
+        indices_by_id.setdefault(custom_id, []).append(i)
+    try:
+        clients = {model: get_client(model) for model in indices_by_model}
+    except Exception as e:
+        log.warning(f" API call failed: {e}")
+        return [""] * len(prompts)
+
+    # Resume saved jobs for this run's models; only requests none of them cover are submitted again.
+    state = load_batch_state()
+    pending = {}
+    covered = set()
+    for batch_id, job in state.items():
+        model = job.get("model")
+        if model not in indices_by_model:
+            continue
+        job_ids = set(job.get("custom_ids") or ())
+        pending[batch_id] = model
+        covered |= job_ids
+        log.info(f" {model}: resuming batch {batch_id} from {_batch_state_path()} "
+                 f"({len(job_ids & indices_by_id.keys())} of this run's requests)")
+
+    resumed_models = set(pending.values())
+    for model, indices in indices_by_model.items():
+        todo = [i for i in indices if custom_ids[i] not in covered]
+        if not todo:
+            continue
+        client = clients[model]
+        body = "".join(
+            _batch_request_line(custom_ids[i], prompts[i], model, temperature) + "\n" for i in todo
+        )
+        try:
+            input_file = client.files.create(
+                file=(f"trigger_query_{model}.jsonl", body.encode("utf-8")), purpose="batch"
+            )
+            batch = client.batches.create(
+                input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+            )
+        except Exception as e:
+            log.warning(f" Batch submission failed for {model}: {e}")
+            continue
+        pending[batch.id] = model
+        state[batch.id] = {"model": model, "custom_ids": [custom_ids[i] for i in todo]}
+        save_batch_state(state)
+        extra = " not covered by resumed batches" if model in resumed_models else ""
+        log.info(f" {model}: submitted batch {batch.id} ({len(todo)} requests{extra})")
+
+    responses = [""] * len(prompts)
+    failures = dict.fromkeys(pending, 0)
+    while pending:
+        for batch_id, model in list(pending.items()):
+            client = clients[model]
+            try:
+                batch = client.batches.retrieve(batch_id)
+                if batch.status not in _BATCH_FINAL_STATUSES:
+                    failures[batch_id] = 0
+                    continue
+                output = client.files.content(batch.output_file_id).text if batch.output_file_id else ""
+            except Exception as e:
+                failures[batch_id] += 1
+                log.warning(f" Batch {batch_id} ({model}) check failed ({failures[batch_id]}/{BATCH_MAX_POLL_FAILURES}): {e}")
+                if failures[batch_id] >= BATCH_MAX_POLL_FAILURES:
+                    del pending[batch_id]
+                    log.warning(f" {model}: giving up on batch {batch_id}; rerun with --batch to resume it")
+                continue
+
+            del pending[batch_id]
+            log.info(f" {model}: batch {batch_id} {batch.status}")
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                # A malformed line only loses its own request, not the rest of the job.
+                try:
+                    row = json.loads(line)
+                    text = _batch_output_text(row)
+                    # A request answered by both a resumed job and a new one is only delivered once;
+                    # a failed answer ("") leaves it open for the other job.
+                    indices = indices_by_id.pop(row["custom_id"], []) if text else []
+                except Exception as e:
+                    log.warning(f" Batch {batch_id} ({model}): skipping bad output line: {e}")
+                    continue
+                for i in indices:
+                    responses[i] = text
+                    if on_response is not None:
+                        on_response(i, text)
+            state.pop(batch_id, None)
+            save_batch_state(state)
+        if pending:
+            time.sleep(BATCH_POLL_SECONDS)
+    return responses
 
-def load_cue_dialogues():
+def parse_trigger_records(cue_item, resp):
+    # Output records for one cue from its model response, plus the result items that were malformed.
+    # Both lists are empty when the response is empty or not parseable.
+    results = safe_json_parse(resp) if resp else []
+    if isinstance(results, dict) and "items" in results:
+        results = results["items"]
+    if not results:
+        return [], []
+    if not isinstance(results, list):
+        results = [results]
+
+    records, invalid = [], []
+    for result in results:
+        if isinstance(result, dict) and "trigger_query" in result and "time_gap" in result:
+            # The model only returns trigger_query / time_gap; the cue fields come from the input item.
+            records.append({
+                "relation_type": cue_item["relation_type"],
+                "cue_dialogue": cue_item["cue_dialogue"],
+                "trigger_query": result["trigger_query"],
+                "time_gap": result["time_gap"],
+                "model_name": cue_item["model_name"],
+            })
+        else:
+            invalid.append(result)
+    return records, invalid
+
+def json_line(obj) -> str:
+    # One JSON Lines record (UTF-8, no ASCII escaping); orjson when installed.
+    if orjson is not None:
+        return orjson.dumps(obj).decode() + "\n"
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+def iter_jsonl(path):
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+def compact_output(jsonl_path, json_path):
+    # Rewrite the append-only JSONL log as one indented JSON array (e.g. for rank.py); returns the record count.
+    records = list(iter_jsonl(jsonl_path))
+    if orjson is not None:
+        with open(json_path, "wb") as f:
+            f.write(orjson.dumps(records, option=orjson.OPT_INDENT_2))
+    else:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+    return len(records)
+
+def cue_model_key(cue_dialogue, model_name):
+    # Compact (model, 16-byte digest) key for the already-generated check, instead of a long concatenated string.
+    return model_name, hashlib.blake2b(cue_dialogue.encode("utf-8"), digest_size=16).digest()
+
+def iter_cue_dialogues():
     # CUE_QUERY_INPUT: path to filtered cue dialogues JSON (default: selected_cue_query.json in script dir)
+    # Yields one cue at a time; with ijson installed the file is streamed instead of loaded whole.
     default_path = Path(__file__).resolve().parent / "selected_cue_query.json"
     input_file = os.environ.get("CUE_QUERY_INPUT", str(default_path))
 
     if not os.path.exists(input_file):
-        print(f" File does not exist: {input_file}")
-        return []
+        log.warning(f" File does not exist: {input_file}")
+        return
     
     try:
-        with open(input_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        if ijson is not None:
+            with open(input_file, "rb") as f:
+                yield from ijson.items(f, "item", use_float=True)
+        else:
+            with open(input_file, "rb") as f:
+                data = f.read()
+            yield from (orjson.loads(data) if orjson is not None else json.loads(data))
     except Exception as e:
-        print(f" File loading failed: {e}")
-        return []
+        log.warning(f" File loading failed: {e}")
+
+class _TqdmHandler(logging.Handler):
+    # Writes through tqdm so messages don't break an active progress bar.
+    def emit(self, record):
+        try:
+            tqdm.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+def setup_logging():
+    # Log records are queued and written by a listener thread, off the request/parse path.
+    # TRIGGER_QUERY_LOG_LEVEL=DEBUG also shows a preview and count for every generated cue.
+    handler = _TqdmHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    records = queue.Queue(-1)
+    listener = QueueListener(records, handler)
+    log.addHandler(QueueHandler(records))
+    log.setLevel(os.environ.get("TRIGGER_QUERY_LOG_LEVEL", "INFO").strip().upper() or "INFO")
+    log.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
 
 if __name__ == "__main__":
-    cue_data = load_cue_dialogues()
-    if not cue_data:
-        print(" No cue_dialogue data found")
-        exit(1)
-    
-    print(f" Loaded {len(cue_data)} cue_dialogue records")
-    
-    output_file = "complete_data_all_models.json"
-    
-    existing_complete_data = []
-    if os.path.exists(output_file):
+    parser = argparse.ArgumentParser(description="Generate trigger queries for filtered cue dialogues.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit all requests through the OpenAI Batch API (cheaper, may take up to 24h) "
+                             "instead of concurrent chat.completions calls")
+    parser.add_argument("--compact", action="store_true",
+                        help="Only rewrite the JSONL output log as the indented JSON array file, then exit")
+    args = parser.parse_args()
+    setup_logging()
+
+    # Records are appended to a JSON Lines log as they are produced; the JSON array read by rank.py is
+    # rewritten from it at the end of each run (or on its own with --compact).
+    output_file = "complete_data_all_models.jsonl"
+    compact_file = "complete_data_all_models.json"
+
+    if args.compact:
+        if not os.path.exists(output_file):
+            log.error(f" File does not exist: {output_file}")
+            exit(1)
+        count = compact_output(output_file, compact_file)
+        log.info(f" Wrote {count} records → {compact_file}")
+        exit(0)
+
+    if not os.path.exists(output_file) and os.path.exists(compact_file):
+        # One-time migration: seed the JSONL log from output written as a JSON array by earlier versions.
         try:
-            with open(output_file, "r", encoding="utf-8") as f:
-                existing_complete_data = json.load(f)
-            print(f" Existing {len(existing_complete_data)} complete records")
+            with open(compact_file, "rb") as f:
+                data = f.read()
+            legacy_data = orjson.loads(data) if orjson is not None else json.loads(data)
+            with open(output_file, "w", encoding="utf-8") as f:
+                for item in legacy_data:
+                    f.write(json_line(item))
+            log.info(f" Migrated {len(legacy_data)} records from {compact_file} to {output_file}")
         except Exception as e:
-            print(f" Failed to read existing file: {e}")
-            existing_complete_data = []
+            log.warning(f" Failed to migrate existing file: {e}")
     
     existing_cue_model_pairs = set()
-    for item in existing_complete_data:
-        key = f"{item['cue_dialogue']}_{item['model_name']}"
-        existing_cue_model_pairs.add(key)
+    model_counts = {}
+    existing_count = 0
+    if os.path.exists(output_file):
+        try:
+            for item in iter_jsonl(output_file):
+                existing_cue_model_pairs.add(cue_model_key(item["cue_dialogue"], item["model_name"]))
+                model_counts[item["model_name"]] = model_counts.get(item["model_name"], 0) + 1
+                existing_count += 1
+            log.info(f" Existing {existing_count} complete records")
+        except Exception as e:
+            log.warning(f" Failed to read existing file: {e}")
     
-    all_new_data = []
+    new_count = 0
     
-    new_cue_data = []
-    for cue_item in cue_data:
-        if cue_item.get("model_name") not in model_list:
-            print(f" Skipping unsupported model: {cue_item.get('model_name')}")
+    # Cues are filtered and grouped by model in one pass as they are read, so only the ones still to
+    # generate are kept in memory.
+    cue_count = 0
+    pending_count = 0
+    model_groups = {}
+    for cue_item in iter_cue_dialogues():
+        cue_count += 1
+        model = cue_item.get("model_name")
+        if model not in model_list:
+            log.warning(f" Skipping unsupported model: {model}")
             continue
             
-        key = f"{cue_item['cue_dialogue']}_{cue_item['model_name']}"
-        if key not in existing_cue_model_pairs:
-            new_cue_data.append(cue_item)
+        if cue_model_key(cue_item["cue_dialogue"], model) not in existing_cue_model_pairs:
+            model_groups.setdefault(model, []).append(cue_item)
+            pending_count += 1
     
-    print(f" Need to generate trigger_queries for {len(new_cue_data)} cue_dialogues")
+    if not cue_count:
+        log.error(" No cue_dialogue data found")
+        exit(1)
     
-    model_groups = {}
-    for item in new_cue_data:
-        model = item["model_name"]
-        if model not in model_groups:
-            model_groups[model] = []
-        model_groups[model].append(item)
+    log.info(f" Loaded {cue_count} cue_dialogue records")
+    log.info(f" Need to generate trigger_queries for {pending_count} cue_dialogues")
     
-    print(f"\n Number of records to process per model:")
+    # Requests are laid out model by model (the order records are written in), built in the same
+    # pass that prints the per-model counts.
+    log.info(f"\n Number of records to process per model:")
+    new_cue_data, prompts, models, keys = [], [], [], []
     for model, items in model_groups.items():
-        print(f"   {model}: {len(items)} records")
+        log.info(f"   {model}: {len(items)} records")
+        for cue_item in items:
+            prompt = trigger_query_input(cue_item["cue_dialogue"], cue_item["relation_type"])
+            new_cue_data.append(cue_item)
+            prompts.append(prompt)
+            models.append(model)
+            keys.append(cache_key(model, prompt, 0.9))
+    
+    # Cached answers are reused; all remaining cues are requested at once (concurrently, one worker
+    # pool per model, or as Batch API jobs).
+    responses = [cache_get(key) for key in keys]
+    misses = [i for i, resp in enumerate(responses) if resp is None]
+    if len(misses) < len(responses):
+        log.info(f" Reusing {len(responses) - len(misses)} cached responses")
+    miss_prompts = [prompts[i] for i in misses]
+    miss_models = [models[i] for i in misses]
     
-    for cue_item in tqdm(new_cue_data, desc="Generating trigger_queries"):
+    # Each response is handled as soon as it arrives, while others are still in flight: its records are
+    # appended and flushed to the output log and, if valid, it is cached. An interrupted run keeps
+    # everything received so far.
+    handled = [False] * len(prompts)
+    miss_set = set(misses)
+    def _handle_response(i, resp):
+        global new_count
+        handled[i] = True
+        cue_item = new_cue_data[i]
         model = cue_item["model_name"]
         
-        escaped_cue = cue_item["cue_dialogue"].replace('"', '\\"').replace('\n', '\\n')
-        
-        prompt = TRIGGER_QUERY_PROMPT.format(
-            cue_dialogue=escaped_cue,
-            relation_type=cue_item["relation_type"]
-        )
-        
-        resp = call_openai(prompt, model=model, temperature=0.9)
         if not resp:
-            print(f" Model {model} returned empty response")
-            continue
+            log.warning(f" Model {model} returned empty response for cue: {cue_item['cue_dialogue'][:80]!r}")
+            return
         
-        results = safe_json_parse(resp)
-        if not results:
-            print(f" JSON parsing failed, skipping this record")
-            continue
-            
-        if not isinstance(results, list):
-            results = [results]
+        records, invalid = parse_trigger_records(cue_item, resp)
+        if not records and not invalid:
+            log.warning(f" JSON parsing failed, skipping this record")
+            return
         
-        valid_count = 0
-        for result in results:
-            if isinstance(result, dict) and "trigger_query" in result and "time_gap" in result:
-                result["model_name"] = model
-                all_new_data.append(result)
-                valid_count += 1
-                if valid_count <= 2:
-                    print(f" {model} generated: {result['trigger_query'][:50]}... (Time gap: {result['time_gap']})")
-            else:
-                print(f" Invalid result format: {result}")
+        for result in records:
+            out.write(json_line(result))
+            model_counts[model] = model_counts.get(model, 0) + 1
+        out.flush()
+        new_count += len(records)
+        if log.isEnabledFor(logging.DEBUG):
+            for result in records[:2]:
+                log.debug(f" {model} generated: {result['trigger_query'][:50]}... (Time gap: {result['time_gap']})")
+        for result in invalid:
+            log.warning(f" Invalid result format: {result}")
         
+        valid_count = len(records)
         if valid_count > 0:
-            print(f" {model} generated {valid_count}/5 trigger_queries for cue_dialogue")
+            if i in miss_set:
+                cache_put(keys[i], resp)
+            log.debug(f" {model} generated {valid_count}/5 trigger_queries for cue_dialogue")
         else:
-            print(f" {model} failed to generate any valid trigger_queries")
-        
-        time.sleep(0.5)
-
-    all_complete_data = existing_complete_data + all_new_data
+            log.warning(f" {model} failed to generate any valid trigger_queries")
     
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_complete_data, f, ensure_ascii=False, indent=2)
+    def _handle_miss(j, resp):
+        _handle_response(misses[j], resp)
     
-    print(f"\n\n Complete data for all models saved → {output_file}")
-    print(f" Total complete records: {len(all_complete_data)}")
-    print(f" Newly added: {len(all_new_data)}")
-    
-    model_counts = {}
-    for item in all_complete_data:
-        model = item["model_name"]
-        model_counts[model] = model_counts.get(model, 0) + 1
+    with open(output_file, "a", encoding="utf-8") as out:
+        for i, resp in enumerate(responses):
+            if resp is not None:
+                _handle_response(i, resp)
+        
+        if args.batch:
+            fetched = call_openai_batch(miss_prompts, miss_models, temperature=0.9, on_response=_handle_miss)
+        else:
+            fetched = call_openai_many(
+                miss_prompts, miss_models, temperature=0.9, desc="Generating trigger_queries", on_response=_handle_miss
+            )
+        # Requests a batch job returned nothing for are reported like empty responses.
+        for i, resp in zip(misses, fetched):
+            if not handled[i]:
+                _handle_response(i, resp)
+
+    log.info(f"\n\n Complete data for all models appended → {output_file}")
+    log.info(f" Total complete records: {existing_count + new_count}")
+    log.info(f" Newly added: {new_count}")
+    try:
+        compact_output(output_file, compact_file)
+        log.info(f" Rewrote {compact_file} for rank.py")
+    except Exception as e:
+        log.warning(f" Failed to rewrite {compact_file}: {e}; run with --compact to retry")
     
-    print(f"\n Data distribution per model:")
+    log.info(f"\n Data distribution per model:")
     for model, count in model_counts.items():
-        print(f"   {model}: {count} records")
\ No newline at end of file
+        log.info(f"   {model}: {count} records")